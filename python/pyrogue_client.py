@@ -25,22 +25,36 @@ import pyrogue.protocols
 import pyrogue.utilities.fileio
 import PyQt4.QtGui
 import pyrogue.gui
+import pyrogue_gui
 
 # Print the usage message
 def usage(name):
-    print("Usage: %s -p|--pyro group_name [-h|--help]" % name)
+    print("Usage: %s -p|--pyro group_name [-g|--gui-refresh period] [-h|--help]" % name)
     print("    -h||--help               : show this message")
     print("    -p|--pyro group_name     : Pyro4 group name")
+    print("    -g|--gui-refresh period  : Throttle the GUI updates: refresh only the")
+    print("                               visible widgets, every \"period\" seconds")
     print("")
 
 # Cretae gui interface
-def create_gui(root):
+def create_gui(root, refresh_period=0):
     # Create GUI
     app_top = PyQt4.QtGui.QApplication(sys.argv)
+
+    # The update throttling must be installed before the GUI is created
+    gui_throttle = None
+    if refresh_period:
+        gui_throttle = pyrogue_gui.GuiThrottle(refresh_period)
+        if not gui_throttle.install():
+            gui_throttle = None
+
     gui_top = pyrogue.gui.GuiTop(group='GuiTop')
     gui_top.resize(800, 1000)
     gui_top.addTree(root)
 
+    if gui_throttle:
+        gui_throttle.start(gui_top)
+
     print("Starting GUI...\n")
 
     # Run GUI
@@ -54,7 +68,7 @@ def get_host_name():
 
 # Remote client class
 class RemoteClient(pyrogue.PyroRoot):
-    def __init__(self, group_name):
+    def __init__(self, group_name, refresh_period=0):
         host_name = get_host_name()
         try:
             print("Creating client on %s..." % host_name)
@@ -69,7 +83,7 @@ class RemoteClient(pyrogue.PyroRoot):
                 print("Error reading the root from the server: %s" % ne)
                 self.client.stop()
             else:
-                create_gui(self)
+                create_gui(self, refresh_period)
 
     def __del__(self):
         try:
@@ -81,10 +95,11 @@ class RemoteClient(pyrogue.PyroRoot):
 def main():
 
     group_name = ""
+    refresh_period = 0
 
     # Read Arguments
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "hp:", ["help", "pyro="])
+        opts, _ = getopt.getopt(sys.argv[1:], "hp:g:", ["help", "pyro=", "gui-refresh="])
     except getopt.GetoptError:
         usage(sys.argv[0])
         sys.exit()
@@ -95,6 +110,13 @@ def main():
             sys.exit()
         elif opt in ("-p", "--pyro"):       # Group name
             group_name = arg
+        elif opt in ("-g", "--gui-refresh"): # GUI refresh period
+            try:
+                refresh_period = float(arg)
+            except ValueError:
+                print("    ERROR: Invalid GUI refresh period")
+                print("")
+                exit()
 
     # Chek if pyro group name was defined
     if not group_name:
@@ -103,7 +125,7 @@ def main():
         exit()
 
     # Start client
-    client = RemoteClient(group_name)
+    client = RemoteClient(group_name, refresh_period)
 
     # Stop client
     del client
@@ -0,0 +1,161 @@
+#-----------------------------------------------------------------------------
+# Title      : PyRogue GUI helpers
+#-----------------------------------------------------------------------------
+# File       : python/pyrogue_gui.py
+# Created    : 2026-10-19
+#-----------------------------------------------------------------------------
+# Description:
+# GUI helpers shared by the PyRogue server and client scripts
+#-----------------------------------------------------------------------------
+# This file is part of the pyrogue-control-server software platform. It is subject to
+# the license terms in the LICENSE.txt file found in the top-level directory
+# of this distribution and at:
+#    https://confluence.slac.stanford.edu/display/ppareg/LICENSE.html.
+# No part of the rogue software platform, including this file, may be
+# copied, modified, propagated, or distributed except according to the terms
+# contained in the LICENSE.txt file.
+#-----------------------------------------------------------------------------
+import threading
+import queue
+import weakref
+
+import pyrogue.gui
+import pyrogue.gui.variables
+
+# Get the Qt classes used by the throttling, from the Qt binding (PyQt5 or
+# PyQt4) of a GUI widget, so they match the binding used by the application
+def get_qt_classes(widget):
+    for cls in type(widget).__mro__:
+        if cls.__module__.startswith('PyQt5.'):
+            from PyQt5.QtCore import QTimer
+            from PyQt5.QtWidgets import QTreeWidget
+            return QTimer, QTreeWidget
+        if cls.__module__.startswith('PyQt4.'):
+            from PyQt4.QtCore import QTimer
+            from PyQt4.QtGui import QTreeWidget
+            return QTimer, QTreeWidget
+    raise ImportError("Unknown Qt binding for {}".format(type(widget).__name__))
+
+# Check if a tree item is shown: all its parents are expanded, and it is
+# inside the visible area of its tree
+def is_item_visible(item):
+    tree = item.treeWidget()
+    if tree is None or not tree.isVisible():
+        return False
+
+    parent = item.parent()
+    while parent is not None:
+        if not parent.isExpanded():
+            return False
+        parent = parent.parent()
+
+    return tree.visualItemRect(item).intersects(tree.viewport().rect())
+
+class GuiThrottle():
+    """
+    Update throttling for the pyrogue GUI, for large trees.
+
+    The GUI variable listeners, called from the root threads on each
+    variable update, only record the latest value of each variable. On each
+    repaint tick, every "period" seconds, the recorded values are applied to
+    the widgets which are visible. The values of the hidden widgets are kept,
+    and applied when the widgets are shown.
+
+    When a tree item is expanded, the values of the variables under it are
+    fetched again in a worker thread, so the Qt event loop never waits for
+    them (which, on a Pyro4 client, are remote calls).
+
+    The throttling is installed by replacing the listener of the GUI
+    variable widgets, so it must be installed before the GUI is created.
+    """
+    def __init__(self, period):
+        self._period = period
+        self._lock = threading.Lock()
+
+        # GUI variable link -> latest (path, value, disp)
+        self._pending = {}
+        self._links = weakref.WeakSet()
+        self._fetch_queue = queue.Queue()
+        self._timer = None
+        self._var_listener = None
+
+    def install(self):
+        """
+        Function to install the throttling. It returns False if the GUI
+        variable widgets are not supported.
+        """
+        link_class = getattr(pyrogue.gui.variables, 'VariableLink', None)
+        if link_class is None or not hasattr(link_class, 'varListener'):
+            print("GUI update throttling is not supported by this pyrogue version")
+            return False
+
+        self._var_listener = link_class.varListener
+        link_class.varListener = lambda link, path, value, disp: self._record(link, path, value, disp)
+
+        threading.Thread(target=self._fetch_worker, name='GuiFetch', daemon=True).start()
+        return True
+
+    def start(self, gui_top):
+        """
+        Function to start the repaint tick. It must be called from the Qt
+        thread, once the GUI has been created.
+        """
+        QTimer, QTreeWidget = get_qt_classes(gui_top)
+
+        for tree in gui_top.findChildren(QTreeWidget):
+            tree.itemExpanded.connect(self._item_expanded)
+
+        self._timer = QTimer(gui_top)
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(int(self._period * 1000))
+
+        print("GUI update throttling enabled (repaint every {} s)".format(self._period))
+
+    def _record(self, link, path, value, disp):
+        with self._lock:
+            self._pending[link] = (path, value, disp)
+            self._links.add(link)
+
+    def _tick(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        hidden = {}
+        for link, args in pending.items():
+            item = getattr(link, '_item', None)
+            if item is not None and not is_item_visible(item):
+                hidden[link] = args
+                continue
+
+            try:
+                self._var_listener(link, *args)
+            except Exception as e:
+                print("Error updating GUI widget for {}: {}".format(args[0], e))
+
+        # Keep the values of the hidden widgets, unless a newer one arrived
+        with self._lock:
+            for link, args in hidden.items():
+                self._pending.setdefault(link, args)
+
+    def _item_expanded(self, item):
+        with self._lock:
+            links = list(self._links)
+
+        for link in links:
+            parent = getattr(link, '_item', None)
+            while parent is not None and parent is not item:
+                parent = parent.parent()
+            if parent is not None:
+                self._fetch_queue.put(link)
+
+    def _fetch_worker(self):
+        while True:
+            link = self._fetch_queue.get()
+            variable = getattr(link, '_variable', None)
+            if variable is None:
+                continue
+
+            try:
+                self._record(link, None, variable.value(), variable.valueDisp())
+            except Exception as e:
+                print("Error reading {} for the GUI: {}".format(variable.path, e))
@@ -23,8 +23,18 @@ import os
 import subprocess
 import time
 import struct
+import threading
+import signal
+import json
+import asyncio
+import contextlib
+import collections
+import functools
+import fnmatch
+import yaml
 from packaging import version
 from pathlib import Path
+import numpy as np
 
 import pyrogue
 import pyrogue.utilities.fileio
@@ -35,7 +45,13 @@ def usage(name):
     print("Usage: {} [-a|--addr IP_address] [-d|--defaults config_file]".format(name),\
         " [-s|--server] [-p|--pyro group_name] [-e|--epics prefix]",\
         " [-n|--nopoll] [-b|--stream-size byte_size] [-f|--stream-type data_type]",\
-        " [-c|--commType comm_type] [-l|--slot slot_number] [-h|--help]")
+        " [-c|--commType comm_type] [-l|--slot slot_number]",\
+        " [-w|--status-port port] [-m|--metrics-port port] [-o|--output-dir dir]",\
+        " [-r|--ring-depth depth] [-i|--stream-channels num]",\
+        " [-k|--stream-header size]",\
+        " [-x|--replay file] [-q|--replay-rate rate]",\
+        " [-y|--tuning-file file] [-j|--link-recovery checks]",\
+        " [-g|--gui-refresh period] [-h|--help]")
     print("    -h|--help                  : Show this message")
     print("    -a|--addr IP_address       : FPGA IP address. Mandatory",\
         "if Ethernet communication is used")
@@ -55,9 +71,34 @@ def usage(name):
         "PVs. Only the first \"data_size\" points will be exposed.",\
         "(Must be used with -e)")
     print("    -f|--stream-type data_type : Stream data type (UInt16, Int16,",\
-        "UInt32 or Int32). Default is UInt16. (Must be used with -e and -b)")
+        "UInt32, Int32, Float32, UInt24 or Int24; the 24-bit types are packed).",\
+        "Default is UInt16.")
+    print("    -i|--stream-channels num   : Number of channels interleaved in each",\
+        "stream. Each channel is exposed as a separate PV. Default is 1.")
+    print("    -k|--stream-header size    : Size, in bytes, of the header at the",\
+        "beginning of each stream frame, which is skipped. Default is 0.")
+    print("    -x|--replay file           : Replay a DDR stream capture file,",\
+        "recorded by \"streamDataWriter\", instead of using the FPGA")
+    print("    -q|--replay-rate rate      : Rate, in triggers per second, at which",\
+        "the capture file was recorded. Default is 1. (Must be used with -x)")
+    print("    -y|--tuning-file file      : YAML file with the per-variable tuning",\
+        "settings (read cache, write coalescing and EPICS monitor filter)")
+    print("    -j|--link-recovery checks  : Number of consecutive failed link",\
+        "health checks after which the FPGA link is reopened and the",\
+        "configuration restored. 0 disables it. Default is 3")
+    print("    -g|--gui-refresh period    : Throttle the GUI updates: refresh only",\
+        "the visible widgets, every \"period\" seconds")
     print("    -u|--dump-pvs file_name    : Dump the PV list to \"file_name\".",\
         "(Must be used with -e)")
+    print("    -w|--status-port port      : Serve a JSON status snapshot on",\
+        "http://localhost:port/status")
+    print("    -m|--metrics-port port     : Serve the server metrics, in Prometheus",\
+        "text format, on http://localhost:port/metrics")
+    print("    -o|--output-dir dir        : Directory where the diagnostic dumps",\
+        "(like the profiler results) are written. Default is /tmp")
+    print("    -r|--ring-depth depth      : Keep the last \"depth\" frames of each",\
+        "DDR stream in memory. Each frame is truncated to the stream size",\
+        "(-b) or to {} points if not defined".format(FrameRing.default_size))
     print("")
     print("Examples:")
     print("    {} -a IP_address                            :".format(name),\
@@ -69,11 +110,23 @@ def usage(name):
     print("")
 
 # Create gui interface
-def create_gui(root):
+def create_gui(root, refresh_period=0):
     app_top = pyrogue.gui.application(sys.argv)
+
+    # The update throttling must be installed before the GUI is created
+    gui_throttle = None
+    if refresh_period:
+        gui_throttle = pyrogue_gui.GuiThrottle(refresh_period)
+        if not gui_throttle.install():
+            gui_throttle = None
+
     gui_top = pyrogue.gui.GuiTop(group='GuiTop')
     gui_top.resize(800, 1000)
     gui_top.addTree(root)
+
+    if gui_throttle:
+        gui_throttle.start(gui_top)
+
     print("Starting GUI...\n")
 
     try:
@@ -82,69 +135,1672 @@ def create_gui(root):
         # Catch keyboard interrupts while the GUI was open
         pass
 
-    print("GUI was closed...")
+    print("GUI was closed...")
+
+# Exit with a error message
+def exit_message(message):
+    print(message)
+    print("")
+    exit()
+
+# Stream data types, and the ones the GDD-based EPICS server stream slaves can decode
+stream_data_types = ['UInt16', 'Int16', 'UInt32', 'Int32', 'Float32', 'UInt24', 'Int24']
+gdd_stream_data_types = ['UInt16', 'Int16', 'UInt32', 'Int32']
+
+# Load the tuning file. It is a YAML file with one section per feature, each
+# one mapping variable path patterns (as used by fnmatch) to their settings.
+# A ValueError is raised if the content is not valid.
+def load_tuning_file(file_name):
+    with open(file_name) as f:
+        tuning = yaml.safe_load(f)
+
+    if not tuning:
+        return {}
+
+    if not isinstance(tuning, dict):
+        raise ValueError("the tuning file must contain a mapping of sections")
+
+    for section in list(tuning):
+        # An empty section has no settings
+        if tuning[section] is None:
+            tuning[section] = {}
+
+        if not isinstance(tuning[section], dict):
+            raise ValueError("section \"{}\" must map variable path patterns to settings"\
+                .format(section))
+
+        for pattern, settings in tuning[section].items():
+            if not isinstance(pattern, str):
+                raise ValueError("invalid variable path pattern \"{}\" in section \"{}\""\
+                    .format(pattern, section))
+
+            if section == 'MonitorFilter':
+                if not isinstance(settings, dict):
+                    raise ValueError("settings of \"{}\" in section \"{}\" must be a mapping"\
+                        .format(pattern, section))
+                values = settings.values()
+            else:
+                values = [settings]
+
+            for value in values:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError("invalid setting \"{}\" for \"{}\" in section \"{}\""\
+                        .format(value, pattern, section))
+
+    return tuning
+
+# Get the settings of the first pattern, in a tuning section, matching a variable path
+def match_tuning(section, path):
+    for pattern, settings in section.items():
+        if fnmatch.fnmatchcase(path, pattern):
+            return settings
+    return None
+
+# Get the hostname of this PC
+def get_host_name():
+    return subprocess.check_output("hostname").strip().decode("utf-8")
+
+# Get the CPU time (user + system, in seconds) used by each thread of this process
+def get_thread_cpu_times():
+    names = {getattr(t, 'native_id', None): t.name for t in threading.enumerate()}
+    tick = os.sysconf('SC_CLK_TCK')
+    cpu_times = {}
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open('/proc/self/task/{}/stat'.format(tid)) as f:
+                # The thread name is between parenthesis and can contain spaces
+                stat = f.read()
+            comm = stat[stat.index('(') + 1:stat.rindex(')')]
+            fields = stat[stat.rindex(')') + 2:].split()
+        except (IOError, ValueError):
+            # The thread finished while we were reading it
+            continue
+        name = names.get(int(tid), comm)
+        cpu_times[(tid, name)] = (int(fields[11]) + int(fields[12])) / tick
+    return cpu_times
+
+# Get the number of established TCP connections to a local port
+def get_tcp_client_count(port):
+    count = 0
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                lines = f.readlines()[1:]
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # State '01' is ESTABLISHED
+            if int(fields[1].split(':')[1], 16) == port and fields[3] == '01':
+                count += 1
+    return count
+
+class FrameDecoder():
+    """
+    Decoder of the stream frames, shared by all the users of a stream (data
+    PVs, ring buffers, statistics and acquisition engine), so they all see
+    the same samples.
+
+    The frame can start with a header, which is skipped, and can contain
+    the samples of several channels interleaved. The data format and byte
+    order can be changed at runtime. The header size is fixed, as it sets
+    the maximum frame size used to size the stream FIFOs and buffers. Each
+    frame is decoded using numpy views of its data.
+    """
+    def __init__(self, data_type, channels=1, header_size=0):
+        self._channels = channels
+        self._header_size = header_size
+
+        # Supported data format and byte order
+        self._data_format_dict = {
+            'B': 'unsigned 8-bit',
+            'b': 'signed 8-bit',
+            'H': 'unsigned 16-bit',
+            'h': 'signed 16-bit',
+            'I': 'unsigned 32-bit',
+            'i': 'signed 32-bit',
+            'f': 'float 32-bit',
+            'u3': 'unsigned 24-bit (packed)',
+            'i3': 'signed 24-bit (packed)'}
+
+        self._data_byte_order_dict = {
+            '<': 'little-endian',
+            '>': 'big-endian'}
+
+        # Get data format from data type
+        self._data_format = {
+            'UInt16': 'H',
+            'Int16': 'h',
+            'UInt32': 'I',
+            'Float32': 'f',
+            'UInt24': 'u3',
+            'Int24': 'i3'}.get(data_type, 'i')
+
+        # Byte order: LE
+        self._data_byte_order = '<'
+
+    def get_channels(self):
+        """
+        Function to read the number of interleaved channels
+        """
+        return self._channels
+
+    def get_dtype(self):
+        """
+        Function to get the numpy data type of the decoded samples
+        """
+        return np.dtype({'u3': 'u4', 'i3': 'i4'}.get(self._data_format, self._data_format))
+
+    def max_frame_bytes(self, size):
+        """
+        Function to get the maximum number of bytes of a frame with "size"
+        points per channel, for any data format
+        """
+        return self._header_size + size * self._channels * 4
+
+    def decode(self, data):
+        """
+        Function to decode an array of bytes, without header, using the
+        current data format
+        """
+        if self._data_format in ('u3', 'i3'):
+            # Packed 24-bit samples are expanded to 32-bit
+            samples = data[:(len(data) // 3) * 3].reshape(-1, 3).astype(np.uint32)
+            if self._data_byte_order == '>':
+                samples = samples[:, ::-1]
+            values = samples[:, 0] | (samples[:, 1] << 8) | (samples[:, 2] << 16)
+
+            # Sign extend the signed samples
+            if self._data_format == 'i3':
+                values = (values.astype(np.int32) ^ 0x800000) - 0x800000
+            return values
+
+        dtype = np.dtype(self._data_byte_order + self._data_format)
+        return data[:(len(data) // dtype.itemsize) * dtype.itemsize].view(dtype)
+
+    def decode_frame(self, data):
+        """
+        Function to decode the bytes of a whole frame. It returns the
+        samples, with the channels interleaved.
+        """
+        return self.decode(data[self._header_size:])
+
+    def split(self, samples, size):
+        """
+        Function to split decoded samples in a list of channels of up to
+        "size" points. Each channel is a strided view of the samples.
+        """
+        return [samples[i::self._channels][:size] for i in range(self._channels)]
+
+    def decode_block(self, rows, lengths, size):
+        """
+        Function to decode a block of frames, stored as rows of bytes with
+        their byte lengths. It returns an array of shape (frames, channels,
+        size), padded with zeros, and the number of points of each frame.
+        """
+        block = np.zeros((len(rows), self._channels, size), dtype=self.get_dtype())
+        points = np.zeros(len(rows), dtype=np.uint32)
+        for k in range(len(rows)):
+            channels = self.split(self.decode_frame(rows[k, :lengths[k]]), size)
+            points[k] = len(channels[-1])
+            for j, channel in enumerate(channels):
+                block[k, j, :points[k]] = channel[:points[k]]
+        return block, points
+
+    def get_data_format_string(self):
+        """
+        Function to get the current format string
+        """
+        return '{}{}'.format(self._data_byte_order, self._data_format)
+
+    def get_data_format_list(self):
+        """
+        Function to get a list of supported data formats
+        """
+        return list(self._data_format_dict.values())
+
+    def get_data_byte_order_list(self):
+        """
+        Function to get a list of supported data byte order options
+        """
+        return list(self._data_byte_order_dict.values())
+
+    def set_data_format(self, dev, var, value):
+        """
+        Function to set the data format
+        """
+        if (value < len(self._data_format_dict)):
+            self._data_format = list(self._data_format_dict)[value]
+
+    def get_data_format(self):
+        """
+        Function to read the data format
+        """
+        return list(self._data_format_dict).index(self._data_format)
+
+    def set_data_byte_order(self, dev, var, value):
+        """
+        Function to set the data byte order
+        """
+        if (value < len(self._data_byte_order_dict)):
+            self._data_byte_order = list(self._data_byte_order_dict)[value]
+
+    def get_data_byte_order(self):
+        """
+        Function to read the data byte order
+        """
+        return list(self._data_byte_order_dict).index(self._data_byte_order)
+
+    def get_header_size(self):
+        """
+        Function to read the size, in bytes, of the frame header
+        """
+        return self._header_size
+
+class DataBuffer(rogue.interfaces.stream.Slave):
+    """
+    Data buffer class use to capture data coming from the stream FIFO \
+    and copy it into a local buffer using a specific data format.
+
+    The frames are decoded by the stream decoder. When the frame contains
+    several interleaved channels, each channel data is available as a
+    separate buffer.
+    """
+    def __init__(self, size, decoder):
+        rogue.interfaces.stream.Slave.__init__(self)
+        self._size = size
+        self._decoder = decoder
+        self._frame = np.zeros(0)
+        self._buf = [np.zeros(0)] * decoder.get_channels()
+
+        # Callback function
+        self._callback = lambda: None
+
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        data = np.empty(frame.getPayload(), dtype=np.uint8)
+        frame.read(data, 0)
+        self._frame = self._decoder.decode_frame(data)
+        self._buf = self._decoder.split(self._frame, self._size)
+        self._callback()
+
+    def set_callback(self, callback):
+        """
+        Function to set the callback function
+        """
+        self._callback = callback
+
+    def read(self, channel=0):
+        """
+        Function to read the data buffer of a channel
+        """
+        return self._buf[channel]
+
+    def read_frame(self):
+        """
+        Function to read the whole decoded frame, with the channels interleaved
+        """
+        return self._frame[:self._size * len(self._buf)]
+
+class ReadCoalescer():
+    """
+    Single-flight layer for the reads of hardware-backed variables.
+
+    Concurrent reads of the same variable (for example from the GUI, Pyro
+    and EPICS clients) share a single hardware transaction: the first
+    caller does the read, and the others wait for it to finish and then
+    return the value it read.
+
+    Optionally, each variable can have a freshness window: reads done
+    within that time after the last hardware read are served with the
+    cached value, without any hardware transaction.
+
+    The layer is installed by replacing the "get" method of each variable.
+    """
+    def __init__(self, metrics):
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._last_read = {}
+        self._ttl = {}
+        self._gets = {}
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+    def install(self, variables, ttl_config):
+        """
+        Function to install the layer on a list of variables. "ttl_config"
+        maps variable path patterns to freshness windows, in seconds.
+        """
+        for var in variables:
+            ttl = match_tuning(ttl_config, var.path)
+            if ttl:
+                self._ttl[var.path] = float(ttl)
+
+            # Keep the exposed attributes of the original method, so it is still exposed to Pyro
+            get = var.get
+            self._gets[var.path] = get
+            var.get = functools.wraps(get)(
+                lambda *args, var=var, get=get, **kwargs: self._get(var, get, *args, **kwargs))
+
+        print("Read coalescing enabled on {} variables ({} with freshness window)"\
+            .format(len(variables), len(self._ttl)))
+
+    def read(self, var):
+        """
+        Function to read a variable from the hardware, bypassing the cached
+        values and the in-flight reads
+        """
+        return self._gets.get(var.path, var.get)(read=True)
+
+    def invalidate(self):
+        """
+        Function to discard all the cached values
+        """
+        with self._lock:
+            self._last_read.clear()
+
+    def get_hits(self):
+        """
+        Function to read the number of reads served from the cache
+        """
+        return self._hits
+
+    def get_misses(self):
+        """
+        Function to read the number of reads which generated a hardware transaction
+        """
+        return self._misses
+
+    def get_coalesced(self):
+        """
+        Function to read the number of reads which shared an in-flight transaction
+        """
+        return self._coalesced
+
+    def _get(self, var, get, read=True, *args, **kwargs):
+        # Only plain hardware reads are coalesced
+        if not read or args or kwargs:
+            return get(read, *args, **kwargs)
+
+        path = var.path
+        with self._lock:
+            ttl = self._ttl.get(path)
+            last_read = self._last_read.get(path)
+            if ttl and last_read and time.time() - last_read < ttl:
+                self._hits += 1
+                self._metrics.inc('read_cache_hits_total')
+                event = None
+                leader = False
+            elif path in self._inflight:
+                self._coalesced += 1
+                self._metrics.inc('read_coalesced_total')
+                event = self._inflight[path]
+                leader = False
+            else:
+                self._misses += 1
+                self._metrics.inc('read_cache_misses_total')
+                event = threading.Event()
+                event.error = None
+                self._inflight[path] = event
+                leader = True
+
+        if not leader:
+            if event:
+                event.wait()
+                if event.error:
+                    raise event.error
+            return get(read=False)
+
+        start = time.time()
+        try:
+            value = get(read=True)
+        except Exception as e:
+            event.error = e
+            self._metrics.inc('register_errors_total')
+            raise
+        else:
+            self._metrics.observe('variable_read_seconds', time.time() - start)
+            with self._lock:
+                self._last_read[path] = time.time()
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[path]
+            event.set()
+
+class WriteCoalescer():
+    """
+    Last-write-wins coalescing stage for the writes of hardware-backed
+    variables.
+
+    A write to a coalesced variable is queued for the variable's window,
+    in seconds. Writes to the same variable arriving within that window
+    replace the pending value, so only the last value is written to the
+    hardware, once the window expires.
+
+    Pending writes are always written in the order in which they were
+    issued: a write replacing a pending value is moved to the end of the
+    queue. The queue is written when the window of its first write
+    expires. Any write to a variable which is not coalesced, any command
+    call, and any read of a variable with a pending write, first writes all
+    the pending values, so writes and commands are never reordered.
+
+    The stage is installed by replacing the "set" and "get" methods of the
+    variables, and the call methods of the command classes.
+    """
+    def __init__(self, metrics):
+        self._metrics = metrics
+        self._cond = threading.Condition()
+        self._write_lock = threading.RLock()
+
+        # path -> [variable set function, value, deadline]
+        self._pending = collections.OrderedDict()
+        self._coalesced = 0
+        self._thread = None
+
+    def install(self, variables, window_config):
+        """
+        Function to install the stage on a list of variables. "window_config"
+        maps variable path patterns to coalescing windows, in seconds.
+        Nothing is installed if no variable is coalesced.
+        """
+        windows = {}
+        for var in variables:
+            window = match_tuning(window_config, var.path)
+            if window:
+                windows[var.path] = float(window)
+
+        if not windows:
+            return
+
+        for var in variables:
+            get = var.get
+            var.get = functools.wraps(get)(
+                lambda *args, var=var, get=get, **kwargs: self._get(var, get, *args, **kwargs))
+
+            set = var.set
+            if var.path in windows:
+                var.set = functools.wraps(set)(
+                    lambda *args, var=var, set=set, window=windows[var.path], **kwargs:\
+                        self._set(var, set, window, *args, **kwargs))
+            else:
+                var.set = functools.wraps(set)(
+                    lambda *args, set=set, **kwargs: self._set_barrier(set, *args, **kwargs))
+
+        # Commands, local or remote, are never coalesced. As they can access the
+        # hardware in any way, the pending writes are written before calling them.
+        # The call methods are looked up in the class, so they are replaced there.
+        command_classes = [pyrogue.BaseCommand]
+        for cls in command_classes:
+            command_classes.extend(cls.__subclasses__())
+
+        for cls in command_classes:
+            for name in ['__call__', 'call', 'set']:
+                if name in vars(cls):
+                    call = getattr(cls, name)
+                    setattr(cls, name, functools.wraps(call)(
+                        lambda *args, call=call, **kwargs: self._set_barrier(call, *args, **kwargs)))
+
+        self._thread = threading.Thread(target=self._run, name='WriteCoalescer', daemon=True)
+        self._thread.start()
+
+        print("Write coalescing enabled on {} variables".format(len(windows)))
+
+    def get_coalesced(self):
+        """
+        Function to read the number of writes replaced by a later write
+        """
+        return self._coalesced
+
+    def get_pending(self):
+        """
+        Function to read the number of pending writes
+        """
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Function to write all the pending values, in order
+        """
+        with self._write_lock:
+            while self._pending:
+                self._write_next()
+
+    def _write_next(self):
+        # Must be called with the write lock held
+        with self._cond:
+            path, (set, value, deadline) = self._pending.popitem(last=False)
+
+        try:
+            set(value, write=True)
+        except Exception as e:
+            self._metrics.inc('register_errors_total')
+            print("Error writing coalesced value to {}: {}".format(path, e))
+        else:
+            self._metrics.inc('write_flushed_total')
+
+    def _set(self, var, set, window, value, write=True, *args, **kwargs):
+        # Only plain writes are coalesced; any other set is a barrier
+        if not write or args or kwargs:
+            return self._set_barrier(set, value, write, *args, **kwargs)
+
+        with self._cond:
+            if var.path in self._pending:
+                # Last write wins. It is moved to the end of the queue, so it is
+                # still written after the writes issued before it, but it keeps
+                # the deadline of the first write it replaced.
+                self._pending[var.path][1] = value
+                self._pending.move_to_end(var.path)
+                self._coalesced += 1
+                self._metrics.inc('write_coalesced_total')
+                self._cond.notify()
+            else:
+                self._pending[var.path] = [set, value, time.time() + window]
+                self._cond.notify()
+
+    def _set_barrier(self, set, *args, **kwargs):
+        if self._pending:
+            self.flush()
+        return set(*args, **kwargs)
+
+    def _get(self, var, get, *args, **kwargs):
+        if var.path in self._pending:
+            self.flush()
+        return get(*args, **kwargs)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Wait for the deadline of the oldest pending write
+                while True:
+                    if self._pending:
+                        timeout = next(iter(self._pending.values()))[2] - time.time()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+
+            with self._write_lock:
+                with self._cond:
+                    due = self._pending and next(iter(self._pending.values()))[2] <= time.time()
+                if due:
+                    self._write_next()
+
+class MonitorFilter():
+    """
+    Deadband and minimum interval filter for the variable updates published
+    to the EPICS server.
+
+    The settings of each variable are:
+    - deadband: an update is not published if the value changed by this
+      amount, or less, from the last published value.
+    - relative_deadband: same as "deadband", but relative to the magnitude
+      of the last published value.
+    - min_interval: minimum time, in seconds, between published updates.
+      An update arriving earlier is held until the interval expires, and
+      replaced by any later update, so the last value is always published.
+
+    The deadbands only apply to numeric scalar values.
+
+    The filter is installed by replacing the "addListener" method of the
+    variables. Only the listeners added inside the "capture" context are
+    filtered, so the updates sent to other listeners (GUI, Pyro clients,
+    linked variables) are not affected.
+    """
+    def __init__(self, metrics, config):
+        self._metrics = metrics
+        self._config = config
+        self._capturing = False
+        self._cond = threading.Condition()
+
+        # key -> (last published value, time)
+        self._last = {}
+
+        # key -> [deadline, listener function, update arguments]
+        self._pending = {}
+        self._suppressed = 0
+        self._thread = None
+
+    def install(self, variables):
+        """
+        Function to install the filter on a list of variables
+        """
+        count = 0
+        for var in variables:
+            settings = match_tuning(self._config, var.path)
+            if not settings:
+                continue
+
+            add_listener = var.addListener
+            var.addListener = functools.wraps(add_listener)(
+                lambda listener, add_listener=add_listener, settings=settings:\
+                    add_listener(self._wrap(listener, settings)))
+            count += 1
+
+        if count:
+            self._thread = threading.Thread(target=self._run, name='MonitorFilter', daemon=True)
+            self._thread.start()
+            print("EPICS monitor filter enabled on {} variables".format(count))
+
+    @contextlib.contextmanager
+    def capture(self):
+        """
+        Context in which the added listeners are filtered
+        """
+        self._capturing = True
+        try:
+            yield
+        finally:
+            self._capturing = False
+
+    def get_suppressed(self):
+        """
+        Function to read the number of suppressed updates
+        """
+        return self._suppressed
+
+    def _wrap(self, listener, settings):
+        if not self._capturing or isinstance(listener, pyrogue.BaseVariable):
+            return listener
+
+        key = object()
+        if hasattr(listener, 'varUpdated'):
+            function = listener.varUpdated
+            update = lambda *args: self._update(key, settings, function, args)
+            return type('FilteredListener', (), {'varUpdated': staticmethod(update)})()
+        else:
+            return functools.wraps(listener)(
+                lambda *args: self._update(key, settings, listener, args))
+
+    def _in_deadband(self, value, last_value, settings):
+        numeric = (int, float, np.number)
+        if isinstance(value, bool) or not isinstance(value, numeric) \
+            or not isinstance(last_value, numeric):
+            return False
+
+        threshold = max(settings.get('deadband', 0),
+            settings.get('relative_deadband', 0) * abs(last_value))
+        return threshold > 0 and abs(value - last_value) <= threshold
+
+    def _suppress(self):
+        # Must be called with the lock held
+        self._suppressed += 1
+        self._metrics.inc('monitor_suppressed_total')
+
+    def _update(self, key, settings, function, args):
+        now = time.time()
+        with self._cond:
+            if key in self._last:
+                last_value, last_time = self._last[key]
+
+                if self._in_deadband(args[1], last_value, settings):
+                    # A held update is now stale too
+                    if self._pending.pop(key, None):
+                        self._suppress()
+                    self._suppress()
+                    return
+
+                deadline = last_time + settings.get('min_interval', 0)
+                if deadline > now:
+                    if key in self._pending:
+                        self._pending[key][2] = args
+                        self._suppress()
+                    else:
+                        self._pending[key] = [deadline, function, args]
+                        self._cond.notify()
+                    return
+
+            self._pending.pop(key, None)
+            self._last[key] = (args[1], now)
+
+        function(*args)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Wait for the deadline of the next held update
+                while True:
+                    now = time.time()
+                    due = [k for k, (deadline, _, _) in self._pending.items() if deadline <= now]
+                    if due:
+                        break
+                    timeout = min((d for d, _, _ in self._pending.values()), default=None)
+                    self._cond.wait(None if timeout is None else timeout - now)
+
+                updates = []
+                for key in due:
+                    _, function, args = self._pending.pop(key)
+                    self._last[key] = (args[1], now)
+                    updates.append((function, args))
+
+            for function, args in updates:
+                try:
+                    function(*args)
+                except Exception as e:
+                    print("Error publishing a held variable update: {}".format(e))
+
+class StreamTap(rogue.interfaces.stream.Slave, rogue.interfaces.stream.Master):
+    """
+    Demand-driven tap of a stream.
+
+    The tap forwards the stream frames to its consumer (usually a FIFO
+    followed by a decoder) only while the consumer is needed, that is
+    while any of the following is true:
+    - The tap is explicitly enabled,
+    - At least one in-process user (like the ring buffers or the
+      acquisition engine) is subscribed to it,
+    - The consumer data was explicitly read by a client recently (see
+      touch() and lease_on_read()).
+
+    The tap is attached to the stream the first time it becomes active.
+    When it becomes idle, it is detached from the stream if the rogue
+    version supports it; otherwise the frames are dropped at the tap,
+    before being copied by the FIFO or decoded.
+    """
+    def __init__(self, stream, consumer=None, lease=10.0):
+        rogue.interfaces.stream.Slave.__init__(self)
+        rogue.interfaces.stream.Master.__init__(self)
+        self._stream = stream
+        self._lease = lease
+        self._lock = threading.Lock()
+        self._enabled = False
+        self._subscribers = set()
+        self._lease_expire = 0
+        self._attached = False
+        self._active = False
+        self._frame_count = 0
+
+        if consumer is not None:
+            self.set_consumer(consumer)
+
+    def set_consumer(self, consumer):
+        """
+        Function to set the consumer of the tap
+        """
+        self._setSlave(consumer)
+
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        if not self._active:
+            return
+
+        self._frame_count += 1
+        self._sendFrame(frame)
+
+    def set_enable(self, dev, var, value):
+        """
+        Function to explicitly enable the tap
+        """
+        self._enabled = bool(value)
+        self.update()
+
+    def get_enable(self):
+        """
+        Function to read the explicit enable state of the tap
+        """
+        return self._enabled
+
+    def subscribe(self, name):
+        """
+        Function to add an in-process subscriber to the tap
+        """
+        with self._lock:
+            self._subscribers.add(name)
+        self.update()
+
+    def unsubscribe(self, name):
+        """
+        Function to remove an in-process subscriber from the tap
+        """
+        with self._lock:
+            self._subscribers.discard(name)
+        self.update()
+
+    def touch(self):
+        """
+        Function to keep the tap active for "lease" seconds. It is called
+        when the consumer data is explicitly read.
+        """
+        self._lease_expire = time.time() + self._lease
+        if not self._active:
+            self.update()
+
+    def lease_on_read(self, variable):
+        """
+        Function to renew the lease when a variable holding the consumer data
+        is explicitly read by a client. The variable updates pushed by the
+        consumer itself only read its cached value, so they do not renew it.
+        """
+        # Keep the exposed attributes of the original method, so it is still exposed to Pyro
+        get = variable.get
+        variable.get = functools.wraps(get)(
+            lambda read=True, *args, get=get, **kwargs: self._get(get, read, *args, **kwargs))
+
+    def _get(self, get, read, *args, **kwargs):
+        if read:
+            self.touch()
+        return get(read, *args, **kwargs)
+
+    def is_active(self):
+        """
+        Function to read the activity state of the tap
+        """
+        return self._active
+
+    def get_frame_count(self):
+        """
+        Function to read the number of frames forwarded to the consumer
+        """
+        return self._frame_count
+
+    def update(self):
+        """
+        Function to attach or detach the tap according to the current demand.
+        It must be called periodically to detect expired leases.
+        """
+        with self._lock:
+            active = self._enabled or bool(self._subscribers) or\
+                time.time() < self._lease_expire
+
+            if active == self._active:
+                return
+
+            if active and not self._attached:
+                pyrogue.streamTap(self._stream, self)
+                self._attached = True
+            elif not active and hasattr(self._stream, '_removeSlave'):
+                self._stream._removeSlave(self)
+                self._attached = False
+
+            self._active = active
+
+class MemoryBudget():
+    """
+    Memory budget shared by a group of buffers, like the stream ring buffers
+    and the acquisition blocks of all the streams.
+
+    Each buffer reserves the memory it needs before allocating it. The
+    reservation is reduced to the memory not reserved by the other buffers,
+    so the total memory used by the group never exceeds "max_bytes".
+    """
+    default_max_bytes = 512 * 1024 * 1024
+
+    def __init__(self, max_bytes=default_max_bytes):
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self._reserved = {}
+
+    def reserve(self, owner, size):
+        """
+        Function to reserve "size" bytes for "owner", replacing its previous
+        reservation. It returns the number of bytes actually reserved.
+        """
+        with self._lock:
+            others = sum(v for k, v in self._reserved.items() if k != id(owner))
+            size = max(0, min(size, self._max_bytes - others))
+            self._reserved[id(owner)] = size
+            return size
+
+    def get_max_bytes(self):
+        """
+        Function to read the total size of the budget, in bytes
+        """
+        return self._max_bytes
+
+class FrameRing(rogue.interfaces.stream.Slave):
+    """
+    Ring buffer class used to keep the last frames received on a stream.
+
+    The raw frames are copied into a preallocated 2D numpy array (one row
+    per frame), so no memory is allocated while receiving them; they are
+    decoded by the stream decoder when the ring content is read. The memory
+    used by the ring is reserved from a memory budget shared with the other
+    stream buffers; the depth is reduced if needed.
+
+    The content of the ring can be dumped to a file on demand, which gives
+    a post-mortem capture of the stream without continuous disk writes.
+    """
+    default_size = 4096
+
+    def __init__(self, depth, size, decoder, budget):
+        rogue.interfaces.stream.Slave.__init__(self)
+        self._lock = threading.Lock()
+        self._decoder = decoder
+        self._size = size
+        self._frame_bytes = decoder.max_frame_bytes(size)
+        self._budget = budget
+        self._allocate(depth)
+
+    def _allocate(self, depth):
+        # Limit the depth to the memory left in the budget
+        frame_bytes = self._frame_bytes
+        max_depth = self._budget.reserve(self, depth * frame_bytes) // frame_bytes
+        if depth > max_depth:
+            print("Ring depth {} exceeds the memory limit. Using {} instead"\
+                .format(depth, max_depth))
+            depth = max_depth
+
+        with self._lock:
+            self._depth = depth
+            self._data = np.zeros((depth, frame_bytes), dtype=np.uint8)
+            self._lengths = np.zeros(depth, dtype=np.uint32)
+            self._timestamps = np.zeros(depth, dtype=np.float64)
+            self._frame_count = 0
+
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        with self._lock:
+            if not self._depth:
+                return
+
+            row = self._frame_count % self._depth
+            length = min(frame.getPayload(), self._frame_bytes)
+
+            # Read the frame directly into its row
+            frame.read(self._data[row, :length], 0)
+            self._lengths[row] = length
+            self._timestamps[row] = time.time()
+            self._frame_count += 1
+
+    def get_depth(self):
+        """
+        Function to read the ring depth
+        """
+        return self._depth
+
+    def set_depth(self, dev, var, value):
+        """
+        Function to set the ring depth. The content of the ring is cleared.
+        """
+        if value >= 0 and value != self._depth:
+            self._allocate(value)
+
+    def get_fill(self):
+        """
+        Function to read the number of frames in the ring
+        """
+        return min(self._frame_count, self._depth)
+
+    def get_snapshot(self):
+        """
+        Function to get the decoded content of the ring, in chronological
+        order. The data has one row per frame or, with interleaved channels,
+        an array of shape (frames, channels, size). The lengths are the
+        number of points of each frame. The frame sequence numbers are
+        counted since the last time the ring was allocated.
+        """
+        with self._lock:
+            fill = min(self._frame_count, self._depth)
+            rows = np.arange(self._frame_count - fill, self._frame_count)
+            raw = self._data[rows % self._depth]
+            byte_lengths = self._lengths[rows % self._depth]
+            timestamps = self._timestamps[rows % self._depth]
+
+        data, lengths = self._decoder.decode_block(raw, byte_lengths, self._size)
+        if self._decoder.get_channels() == 1:
+            data = data[:, 0, :]
+
+        return {
+            'data': data,
+            'lengths': lengths,
+            'timestamps': timestamps,
+            'sequence': rows}
+
+class StreamStats(rogue.interfaces.stream.Slave):
+    """
+    Stream slave class used to compute statistics of the stream data.
+
+    For each frame it computes the mean, RMS, peak-to-peak value and
+    dominant frequency of the data. Optionally, it also computes a power
+    spectrum: the frame is split in segments of "spectrum length" points,
+    each one multiplied by a Hann window, and their power spectra are
+    averaged. The spectrum is then averaged over the last frames using an
+    exponential moving average with a time constant of "spectrum averages"
+    frames. When the spectrum is enabled, the dominant frequency is taken
+    from it.
+
+    The frames are decoded by the stream decoder, and the statistics are
+    computed on one of the interleaved channels.
+
+    All the processing is done with vectorized numpy operations, on a
+    preallocated buffer.
+    """
+    def __init__(self, size, decoder):
+        rogue.interfaces.stream.Slave.__init__(self)
+        self._lock = threading.Lock()
+        self._decoder = decoder
+        self._size = size
+        self._channel = 0
+        self._buf = np.zeros(decoder.max_frame_bytes(size), dtype=np.uint8)
+        self._values = {
+            'mean': 0.0,
+            'rms': 0.0,
+            'peak_to_peak': 0.0,
+            'peak_frequency': 0.0}
+        self._spectrum = np.zeros(0)
+        self._spectrum_length = 0
+        self._spectrum_averages = 1
+        self._sample_rate = 1.0
+        self._window = np.zeros(0)
+
+        # Callback function
+        self._callback = lambda: None
+
+    def set_callback(self, callback):
+        """
+        Function to set the callback function
+        """
+        self._callback = callback
+
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        length = min(frame.getPayload(), len(self._buf))
+        frame.read(self._buf[:length], 0)
+        data = self._decoder.split(self._decoder.decode_frame(self._buf[:length]),
+            self._size)[self._channel]
+        if not len(data):
+            return
+
+        self.process(data)
+        self._callback()
+
+    def process(self, data):
+        """
+        Function to compute the statistics of a block of data
+        """
+        x = data.astype(np.float64)
+        mean = x.mean()
+        x -= mean
+
+        with self._lock:
+            n = self._spectrum_length
+            if n and len(x) >= n:
+                # Averaged power spectrum of the windowed segments
+                segments = x[:(len(x) // n) * n].reshape(-1, n) * self._window
+                psd = (np.abs(np.fft.rfft(segments, axis=1)) ** 2).mean(axis=0)
+                psd /= self._sample_rate * (self._window ** 2).sum()
+
+                if len(self._spectrum) == len(psd):
+                    self._spectrum += (psd - self._spectrum) / self._spectrum_averages
+                else:
+                    self._spectrum = psd
+
+                peak_bin = np.argmax(self._spectrum[1:]) + 1
+            else:
+                n = len(x)
+                peak_bin = np.argmax(np.abs(np.fft.rfft(x))[1:]) + 1 if n > 1 else 0
+
+            self._values['mean'] = float(mean)
+            self._values['rms'] = float(np.sqrt(mean ** 2 + np.mean(x ** 2)))
+            self._values['peak_to_peak'] = float(np.ptp(x))
+            self._values['peak_frequency'] = float(peak_bin * self._sample_rate / n)
+
+    def set_channel(self, dev, var, value):
+        """
+        Function to set the interleaved channel used for the statistics
+        """
+        if 0 <= value < self._decoder.get_channels():
+            with self._lock:
+                self._channel = value
+                self._spectrum = np.zeros(0)
+
+    def get_channel(self):
+        """
+        Function to read the interleaved channel used for the statistics
+        """
+        return self._channel
+
+    def get_value(self, name):
+        """
+        Function to read one of the statistics ('mean', 'rms',
+        'peak_to_peak' or 'peak_frequency')
+        """
+        return self._values[name]
+
+    def get_spectrum(self):
+        """
+        Function to read the averaged power spectrum
+        """
+        with self._lock:
+            return self._spectrum.copy()
+
+    def set_spectrum_length(self, dev, var, value):
+        """
+        Function to set the spectrum length. Zero disables the spectrum.
+        The Hann window needs at least 3 points, and the spectrum can not be
+        longer than the frames.
+        """
+        if value < 0 or value in (1, 2) or value > self._size:
+            print("Invalid spectrum length {}. It must be zero or between 3 and {}"\
+                .format(value, self._size))
+            return
+
+        with self._lock:
+            self._spectrum_length = value
+            self._window = np.hanning(self._spectrum_length)
+            self._spectrum = np.zeros(0)
+
+    def get_spectrum_length(self):
+        """
+        Function to read the spectrum length
+        """
+        return self._spectrum_length
+
+    def set_spectrum_averages(self, dev, var, value):
+        """
+        Function to set the number of frames averaged in the spectrum
+        """
+        with self._lock:
+            self._spectrum_averages = max(1, value)
+
+    def get_spectrum_averages(self):
+        """
+        Function to read the number of frames averaged in the spectrum
+        """
+        return self._spectrum_averages
+
+    def set_sample_rate(self, dev, var, value):
+        """
+        Function to set the sample rate, in Hz, used to scale the frequencies
+        """
+        with self._lock:
+            if value > 0:
+                self._sample_rate = value
+                self._spectrum = np.zeros(0)
+
+    def get_sample_rate(self):
+        """
+        Function to read the sample rate
+        """
+        return self._sample_rate
+
+class AcquisitionBuffer(rogue.interfaces.stream.Slave):
+    """
+    Stream slave class used to collect a block of consecutive frames into
+    a preallocated 2D numpy array (one row per frame).
+
+    Frames are only collected while the buffer is armed, and until the
+    requested number of frames is reached. The raw frames are stored, and
+    decoded by the stream decoder when the block is read. The memory used
+    by the block must be reserved by the caller before arming it.
+    """
+    def __init__(self, size, decoder):
+        rogue.interfaces.stream.Slave.__init__(self)
+        self._cond = threading.Condition()
+        self._decoder = decoder
+        self._size = size
+        self._frame_bytes = decoder.max_frame_bytes(size)
+        self._armed = False
+        self._frames = 0
+        self._count = 0
+        self._sequence_number = 0
+        self._data = np.zeros((0, self._frame_bytes), dtype=np.uint8)
+        self._lengths = np.zeros(0, dtype=np.uint32)
+        self._timestamps = np.zeros(0, dtype=np.float64)
+        self._sequence = np.zeros(0, dtype=np.uint64)
+
+    def get_frame_bytes(self):
+        """
+        Function to read the memory used by each frame of the block, in bytes
+        """
+        return self._frame_bytes
+
+    def arm(self, frames):
+        """
+        Function to start collecting "frames" frames. The block arrays are
+        only reallocated when the number of frames changes.
+        """
+        frame_bytes = self._frame_bytes
+        with self._cond:
+            if frames != len(self._data):
+                self._data = np.zeros((frames, frame_bytes), dtype=np.uint8)
+                self._lengths = np.zeros(frames, dtype=np.uint32)
+                self._timestamps = np.zeros(frames, dtype=np.float64)
+                self._sequence = np.zeros(frames, dtype=np.uint64)
+            self._frames = frames
+            self._count = 0
+            self._armed = True
+
+    def disarm(self):
+        """
+        Function to stop collecting frames
+        """
+        with self._cond:
+            self._armed = False
+
+    def release(self):
+        """
+        Function to stop collecting frames and free the block memory
+        """
+        with self._cond:
+            self._armed = False
+            self._data = np.zeros((0, self._frame_bytes), dtype=np.uint8)
+            self._lengths = np.zeros(0, dtype=np.uint32)
+            self._timestamps = np.zeros(0, dtype=np.float64)
+            self._sequence = np.zeros(0, dtype=np.uint64)
+            self._frames = 0
+            self._count = 0
+
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        with self._cond:
+            # Frame number, counted across the acquisitions. The tap only forwards
+            # frames during an acquisition, so it does not detect frames lost upstream.
+            self._sequence_number += 1
+
+            if not self._armed or self._count >= self._frames:
+                return
+
+            row = self._count
+            length = min(frame.getPayload(), self._frame_bytes)
+
+            # Read the frame directly into its row
+            frame.read(self._data[row, :length], 0)
+            self._lengths[row] = length
+            self._timestamps[row] = time.time()
+            self._sequence[row] = self._sequence_number
+            self._count += 1
+            self._cond.notify_all()
+
+    def wait_count(self, count, deadline):
+        """
+        Function to wait until "count" frames are collected, or the
+        "deadline" time is reached. Returns True if the frames were collected.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._count >= count,
+                timeout=max(0, deadline - time.time()))
+
+    def get_timestamps(self):
+        """
+        Function to get the timestamps of the collected frames
+        """
+        with self._cond:
+            return self._timestamps[:self._count].copy()
+
+    def get_sequence(self):
+        """
+        Function to get the sequence numbers of the collected frames
+        """
+        with self._cond:
+            return self._sequence[:self._count].copy()
+
+    def get_block(self):
+        """
+        Function to get the decoded collected frames. The data has one row
+        per frame or, with interleaved channels, an array of shape (frames,
+        channels, size). The lengths are the number of points of each frame.
+        """
+        with self._cond:
+            raw = self._data[:self._count]
+            byte_lengths = self._lengths[:self._count]
+            timestamps = self._timestamps[:self._count]
+            sequence = self._sequence[:self._count]
+
+        data, lengths = self._decoder.decode_block(raw, byte_lengths, self._size)
+        if self._decoder.get_channels() == 1:
+            data = data[:, 0, :]
+
+        return {
+            'data': data,
+            'lengths': lengths,
+            'timestamps': timestamps,
+            'sequence': sequence}
+
+class TriggeredAcquisition():
+    """
+    Triggered acquisition engine.
+
+    It collects K consecutive triggered frames from the selected DDR streams
+    into one preallocated block per stream, which can then be read as a
+    single array or written to a file.
+
+    If the run control is running, the frames are triggered by it and the
+    engine just collects them. Otherwise, the engine sends one software
+    trigger per frame and waits for the frames of all the selected streams
+    to arrive before sending the next trigger, so triggers and readbacks
+    never race.
+
+    Each accepted acquisition gets a new acquisition ID. A request which is
+    rejected (because of invalid parameters, or not enough memory) sets the
+    state to 'Rejected'; a request done while an acquisition is running is
+    ignored. Clients can check the ID to know if their request was accepted.
+
+    The acquired frames are decoded once, when the acquisition ends. The
+    callback function receives the list of streams whose data changed.
+    """
+    states = ['Idle', 'Running', 'Done', 'Timeout', 'Error', 'Rejected']
+
+    # Maximum number of frames of an acquisition
+    max_frames = 100
+
+    def __init__(self, streams, decoders, size, trigger, is_running, output_dir, budget):
+        self._size = size
+        self._budget = budget
+        self._trigger = trigger
+        self._is_running = is_running
+        self._output_dir = output_dir
+        self._buffers = []
+        self._taps = []
+
+        # The buffers are only fed while an acquisition is running
+        for stream, decoder in zip(streams, decoders):
+            acq_buffer = AcquisitionBuffer(size=size, decoder=decoder)
+            acq_fifo = rogue.interfaces.stream.Fifo(0, decoder.max_frame_bytes(size))
+            acq_fifo._setSlave(acq_buffer)
+            self._buffers.append(acq_buffer)
+            self._taps.append(StreamTap(stream, acq_fifo))
+        self._thread = None
+        self._state = 'Idle'
+        self._acq_id = 0
+        self._last_file = ''
+
+        # Decoded data of the last acquisition, and the streams acquired
+        self._data = [np.zeros(0, dtype=decoder.get_dtype()) for decoder in decoders]
+        self._channels = []
+
+        # Callback function, called when the acquisition state changes
+        self._callback = lambda channels: None
+
+    def set_callback(self, callback):
+        """
+        Function to set the callback function
+        """
+        self._callback = callback
+
+    def get_state(self):
+        """
+        Function to read the acquisition state
+        """
+        return self.states.index(self._state)
+
+    def get_id(self):
+        """
+        Function to read the ID of the last accepted acquisition
+        """
+        return self._acq_id
+
+    def get_last_file(self):
+        """
+        Function to get the name of the last file written
+        """
+        return self._last_file
+
+    def get_max_frames(self):
+        """
+        Function to read the maximum number of frames of an acquisition
+        """
+        return self.max_frames
+
+    def get_data(self, channel):
+        """
+        Function to read the data of the last finished acquisition of a
+        stream, as a flat array. With interleaved channels, the data of each
+        frame is ordered by channel.
+        """
+        return self._data[channel]
+
+    def get_timestamps(self, channel):
+        """
+        Function to read the timestamps of the acquired frames of a stream
+        """
+        return self._buffers[channel].get_timestamps()
+
+    def get_sequence(self, channel):
+        """
+        Function to read the sequence numbers of the acquired frames of a stream
+        """
+        return self._buffers[channel].get_sequence()
+
+    def start(self, frames, channel_mask, timeout, save_file):
+        """
+        Function to start an acquisition of "frames" frames on the streams
+        selected by "channel_mask". "timeout" is the maximum time, in
+        seconds, to wait for each frame.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            print("An acquisition is already running...")
+            return
+
+        channels = [i for i in range(len(self._buffers)) if channel_mask & (1 << i)]
+        if frames < 1 or frames > self.max_frames or not channels:
+            print("Invalid acquisition parameters...")
+            self._set_state('Rejected')
+            return
+
+        # The blocks of the previous acquisition are replaced
+        for acq_buffer in self._buffers:
+            acq_buffer.release()
+
+        changed = sorted(set(self._channels + channels))
+        for i in self._channels:
+            self._data[i] = self._data[i][:0]
+        self._channels = channels
+
+        # All the selected streams collect the same number of frames, so the
+        # memory of all the blocks is reserved at once and split evenly
+        frame_bytes = sum([self._buffers[i].get_frame_bytes() for i in channels])
+        armed = self._budget.reserve(self, frames * frame_bytes) // frame_bytes
+        if armed < frames:
+            print("Acquisition of {} frames exceeds the memory limit. Using {} instead"\
+                .format(frames, armed))
+            frames = armed
+            self._budget.reserve(self, frames * frame_bytes)
+
+        if not frames:
+            print("No memory left for the acquisition...")
+            self._set_state('Rejected', changed)
+            return
+
+        for i in channels:
+            self._buffers[i].arm(frames)
+
+        self._acq_id += 1
+        self._set_state('Running', changed)
+        self._thread = threading.Thread(target=self._run,
+            args=(frames, channels, timeout, save_file), daemon=True)
+        self._thread.start()
+
+    def _set_state(self, state, channels=()):
+        self._state = state
+        self._callback(channels)
+
+    def _run(self, frames, channels, timeout, save_file):
+        buffers = [self._buffers[i] for i in channels]
+        for i in channels:
+            self._taps[i].subscribe('acquisition')
+
+        try:
+            if self._is_running():
+                deadline = time.time() + frames * timeout
+                done = all([b.wait_count(frames, deadline) for b in buffers])
+            else:
+                done = True
+                for k in range(frames):
+                    self._trigger()
+                    deadline = time.time() + timeout
+                    if not all([b.wait_count(k + 1, deadline) for b in buffers]):
+                        done = False
+                        break
+        except Exception as e:
+            print("Error during the acquisition: {}".format(e))
+            self._set_state('Error', channels)
+            return
+        finally:
+            for i in channels:
+                self._taps[i].unsubscribe('acquisition')
+                self._buffers[i].disarm()
+
+        # Decode the acquired frames
+        blocks = {i: self._buffers[i].get_block() for i in channels}
+        for i in channels:
+            self._data[i] = blocks[i]['data'].ravel()
+
+        if save_file:
+            self._save(blocks)
+
+        self._set_state('Done' if done else 'Timeout', channels)
 
-# Exit with a error message
-def exit_message(message):
-    print(message)
-    print("")
-    exit()
+    def _save(self, blocks):
+        arrays = {}
+        for i, block in blocks.items():
+            for name, array in block.items():
+                arrays['{}{}'.format(name, i)] = array
 
-# Get the hostname of this PC
-def get_host_name():
-    return subprocess.check_output("hostname").strip().decode("utf-8")
+        file_name = os.path.join(self._output_dir,
+            'stream_acq_{}.npz'.format(time.strftime('%Y%m%d_%H%M%S')))
+        try:
+            np.savez(file_name, **arrays)
+        except IOError as e:
+            print("Could not write the acquisition file: {}".format(e))
+        else:
+            self._last_file = file_name
+            print("Acquisition written to \"{}\"".format(file_name))
 
-class DataBuffer(rogue.interfaces.stream.Slave):
+class FrameCounter(rogue.interfaces.stream.Slave):
     """
-    Data buffer class use to capture data coming from the stream FIFO \
-    and copy it into a local buffer using a specific data format.
+    Stream slave class used to count the frames and bytes received
+    on a stream, and report them to the server metrics.
     """
-    def __init__(self, size, data_type):
+    def __init__(self, metrics, stream, channel):
         rogue.interfaces.stream.Slave.__init__(self)
-        self._buf = [0] * size
+        self._metrics = metrics
+        self._labels = {'stream': stream, 'channel': channel}
 
-        # Supported data format and byte order
-        self._data_format_dict = {
-            'B': 'unsigned 8-bit',
-            'b': 'signed 8-bit',
-            'H': 'unsigned 16-bit',
-            'h': 'signed 16-bit',
-            'I': 'unsigned 32-bit',
-            'i': 'signed 32-bit'}
+    def _acceptFrame(self, frame):
+        """
+        This method is called when a stream frame is received
+        """
+        self._metrics.inc('stream_frames_total', **self._labels)
+        self._metrics.inc('stream_bytes_total', frame.getPayload(), **self._labels)
 
-        self._data_byte_order_dict = {
-            '<': 'little-endian',
-            '>': 'big-endian'}
+class ServerMetrics():
+    """
+    Registry of server metrics, exported in the Prometheus text exposition
+    format.
 
-        # Get data format and size from data type
-        if data_type == 'UInt16':
-            self._data_format = 'H'
-            self._data_size = 2
-        elif data_type == 'Int16':
-            self._data_format = 'h'
-            self._data_size = 2
-        elif data_type == 'UInt32':
-            self._data_format = 'I'
-            self._data_size = 4
-        else:
-            self._data_format = 'i'
-            self._data_size = 4
+    Counters, gauges and summaries are updated by the different server
+    components. Collector functions are called on each scrape, to refresh
+    the metrics which are cheap to read on demand (like the per-thread CPU
+    time), instead of updating them continuously.
+    """
+    def __init__(self, prefix='pyrogue_server'):
+        self._prefix = prefix
+        self._lock = threading.Lock()
 
-        # Byte order: LE
-        self._data_byte_order = '<'
+        # name -> [type, help, {labels: value}]
+        self._metrics = collections.OrderedDict()
 
-        # Callback function
-        self._callback = lambda: None
+        # Functions called before rendering the metrics
+        self._collectors = []
 
-    def _acceptFrame(self, frame):
+    def describe(self, name, metric_type, help):
         """
-        This method is called when a stream frame is received
+        Function to define a metric type ('counter', 'gauge' or 'summary') and
+        its help string
         """
-        data = bytearray(frame.getPayload())
-        frame.read(data, 0)
-        self._buf = struct.unpack('{}{}{}'.format((self._data_byte_order, \
-            (len(data)//self._data_size), self._data_format), data))
-        self._callback()
+        with self._lock:
+            self._metrics.setdefault(name, [metric_type, help, {}])[:2] = [metric_type, help]
+
+    def inc(self, name, value=1, **labels):
+        """
+        Function to increment a counter
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._metrics.setdefault(name, ['counter', '', {}])[2]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Function to set the value of a gauge
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._metrics.setdefault(name, ['gauge', '', {}])[2][key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Function to add an observation to a summary
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._metrics.setdefault(name, ['summary', '', {}])[2]
+            count, total = values.get(key, (0, 0))
+            values[key] = (count + 1, total + value)
+
+    def add_collector(self, function):
+        """
+        Function to add a collector function, called on each scrape
+        """
+        self._collectors.append(function)
+
+    def render(self):
+        """
+        Function to render the metrics in the Prometheus text format
+        """
+        for function in self._collectors:
+            try:
+                function()
+            except Exception as e:
+                print("Error collecting metrics: {}".format(e))
+
+        lines = []
+        with self._lock:
+            for name, (metric_type, help, values) in self._metrics.items():
+                full_name = '{}_{}'.format(self._prefix, name)
+                if help:
+                    lines.append('# HELP {} {}'.format(full_name, help))
+                lines.append('# TYPE {} {}'.format(full_name, metric_type))
+                for key, value in values.items():
+                    labels = ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"'))\
+                        for k, v in key)
+                    labels = '{{{}}}'.format(labels) if labels else ''
+                    if metric_type == 'summary':
+                        lines.append('{}_count{} {}'.format(full_name, labels, value[0]))
+                        lines.append('{}_sum{} {}'.format(full_name, labels, value[1]))
+                    else:
+                        lines.append('{}{} {}'.format(full_name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler():
+    """
+    Sampling profiler of all the python threads in the process.
+
+    While running, a background thread periodically takes a snapshot of the
+    call stack of all the other threads. The overhead is given by the
+    sampling interval and it is independent of the activity of the server.
+
+    The results are written in the "collapsed stack" format (one line per
+    stack, with its frames separated by semicolons and followed by the number
+    of samples), which can be converted to a flame graph by tools like
+    flamegraph.pl or speedscope.
+
+    Note: threads running in C++ code (like the rogue internal threads) are
+    only seen when they call back into python.
+    """
+    def __init__(self, output_dir, interval=0.01):
+        self._output_dir = output_dir
+        self._interval = interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._last_file = ''
+
+        # Callback function, called when the profiler starts or stops
+        self._callback = lambda: None
 
     def set_callback(self, callback):
         """
@@ -152,76 +1808,354 @@ class DataBuffer(rogue.interfaces.stream.Slave):
         """
         self._callback = callback
 
-    def read(self):
+    def start(self, duration):
         """
-        Function to read the data buffer
+        Function to start the profiler for "duration" seconds
         """
-        return self._buf
+        if self.is_running():
+            print("The profiler is already running...")
+            return
 
-    def get_data_format_string(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,),
+            name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        self._callback()
+
+    def stop(self):
         """
-        Function to get the current format string
+        Function to stop the profiler before its duration expires
         """
-        return '{}{}'.format(self._data_byte_order, self._data_format)
+        self._stop_event.set()
 
-    def get_data_format_list(self):
+    def is_running(self):
         """
-        Function to get a list of supported data formats
+        Function to check if the profiler is running
         """
-        return list(self._data_format_dict.values())
+        return self._thread is not None and self._thread.is_alive()
 
-    def get_data_byte_order_list(self):
+    def get_last_file(self):
         """
-        Function to get a list of supported data byte order options
+        Function to get the name of the last file written
         """
-        return list(self._data_byte_order_dict.values())
-
-    def set_data_format(self, dev, var, value):
+        return self._last_file
+
+    def _run(self, duration):
+        names = {}
+        stacks = collections.Counter()
+        own_id = threading.get_ident()
+        samples = 0
+
+        print("Profiler started for {} seconds...".format(duration))
+        end_time = time.time() + duration
+        while time.time() < end_time and not self._stop_event.is_set():
+            # Refresh the thread names only when new threads are seen
+            frames = sys._current_frames()
+            if not set(frames).issubset(names):
+                names = {t.ident: t.name for t in threading.enumerate()}
+
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name,
+                        os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+
+            samples += 1
+            self._stop_event.wait(self._interval)
+
+        file_name = os.path.join(self._output_dir,
+            'profile_{}.folded'.format(time.strftime('%Y%m%d_%H%M%S')))
+        try:
+            with open(file_name, 'w') as f:
+                for stack, count in stacks.items():
+                    f.write('{} {}\n'.format(stack, count))
+        except IOError as e:
+            print("Could not write the profiler results: {}".format(e))
+        else:
+            self._last_file = file_name
+            print("Profiler stopped after {} samples. Results written to \"{}\""\
+                .format(samples, file_name))
+        finally:
+            self._thread = None
+            self._callback()
+
+class CaptureReplay(pyrogue.Device):
+    """
+    Device used to replay a capture file recorded by a StreamWriter, in
+    place of the FpgaTopLevel streams.
+
+    It provides the same stream interface as the FpgaTopLevel
+    (stream.application(tdest)), so the rest of the server (decoders, PVs,
+    file writers, metrics) works exactly as with the hardware. Each record
+    in the file is sent on the TDEST given by its StreamWriter channel plus
+    "tdest_base".
+
+    The capture files do not include timestamps, so the replay is paced
+    using the rate at which the capture was recorded ("ReplayRate", in
+    triggers per second): records are grouped in shots, a new shot starting
+    when a channel repeats, and the shots are sent at "ReplayRate" times
+    "ReplaySpeed" per second. A "ReplaySpeed" of zero replays the capture
+    as fast as possible.
+    """
+    def __init__(self, file_name, rate=1.0, tdest_base=0x80, **kwargs):
+        pyrogue.Device.__init__(self, name='CaptureReplay',
+            description='Capture file replay', **kwargs)
+        self._file_name = file_name
+        self._tdest_base = tdest_base
+        self._masters = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._frame_count = 0
+
+        # Same stream interface as the FpgaTopLevel
+        self.stream = self
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplayFile',
+            description='Capture file being replayed',
+            mode='RO',
+            value=file_name))
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplayRate',
+            description='Rate at which the capture was recorded, in triggers per second',
+            mode='RW',
+            value=rate))
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplaySpeed',
+            description='Replay speed, as a multiple of ReplayRate. Zero replays as fast as possible',
+            mode='RW',
+            value=1.0))
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplayLoop',
+            description='Restart the replay when the end of the file is reached',
+            mode='RW',
+            value=True))
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplayRunning',
+            description='Replay running status',
+            mode='RO',
+            value=False,
+            localGet=self.is_running,
+            pollInterval=1))
+
+        self.add(pyrogue.LocalVariable(
+            name='ReplayFrameCount',
+            description='Number of frames replayed',
+            mode='RO',
+            value=0,
+            localGet=lambda: self._frame_count,
+            pollInterval=1))
+
+        self.add(pyrogue.LocalCommand(
+            name='ReplayStart',
+            description='Start the replay from the beginning of the file',
+            function=self.start_replay))
+
+        self.add(pyrogue.LocalCommand(
+            name='ReplayStop',
+            description='Stop the replay',
+            function=self.stop_replay))
+
+    def application(self, tdest):
         """
-        Function to set the data format
+        Function to get the stream master of a TDEST
         """
-        if (value < len(self._data_format_dict)):
-            data_format = (list(self._data_format_dict)[value])
-            if data_format == 'B' or data_format == 'b':      # uint8, int8
-                self._data_format = data_format
-                self._data_size = 1
-            elif data_format == 'H' or  data_format == 'h':   # uint16, int16
-                self._data_format = data_format
-                self._data_size = 2
-            elif data_format == 'I' or data_format == 'i':    # uint32, int32
-                self._data_format = data_format
-                self._data_size = 4
+        if tdest not in self._masters:
+            self._masters[tdest] = rogue.interfaces.stream.Master()
+        return self._masters[tdest]
 
-    def get_data_format(self):
+    def is_running(self):
         """
-        Function to read the data format
+        Function to check if the replay is running
         """
-        return list(self._data_format_dict).index(self._data_format)
+        return self._thread is not None and self._thread.is_alive()
 
-    def set_data_byte_order(self, dev, var, value):
+    def start_replay(self):
         """
-        Function to set the data byte order
+        Function to start the replay
         """
-        if (value < len(self._data_byte_order_dict)):
-            self._data_byte_order = list(self._data_byte_order_dict)[value]
+        self.stop_replay()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='CaptureReplay', daemon=True)
+        self._thread.start()
 
-    def get_data_byte_order(self):
+    def stop_replay(self):
         """
-        Function to read the data byte order
+        Function to stop the replay
         """
-        return list(self._data_byte_order_dict).index(self._data_byte_order)
+        self._stop_event.set()
+        if self.is_running():
+            self._thread.join()
+
+    def _read_records(self, f, warn=True):
+        # Each record has a 32-bit size (payload size + 4), followed by a 32-bit
+        # word with the channel (bits 31:24), error (bits 23:16) and flags (bits 15:0).
+        # The file is read until its end, or until a corrupt or truncated record.
+        while True:
+            offset = f.tell()
+            header = f.read(8)
+            if len(header) < 8:
+                if header and warn:
+                    print("Truncated record at offset {} of the capture file".format(offset))
+                return
+            size, info = struct.unpack('<II', header)
+            if size < 4:
+                if warn:
+                    print("Corrupt record at offset {} of the capture file".format(offset))
+                return
+            payload = f.read(size - 4)
+            if len(payload) < size - 4:
+                if warn:
+                    print("Truncated record at offset {} of the capture file".format(offset))
+                return
+            yield (info >> 24) & 0xFF, payload
+
+    def _run(self):
+        print("Replaying capture file \"{}\"...".format(self._file_name))
+        try:
+            with open(self._file_name, 'rb') as f:
+                # The shots are paced across the passes too
+                first_pass = True
+                shot_channels = set()
+                next_time = time.time()
+                while not self._stop_event.is_set():
+                    records = 0
+
+                    for channel, payload in self._read_records(f, warn=first_pass):
+                        if self._stop_event.is_set():
+                            break
+
+                        # Wait for the next shot when a channel repeats
+                        if channel in shot_channels:
+                            shot_channels.clear()
+                            shot_rate = self.ReplayRate.get() * self.ReplaySpeed.get()
+                            if shot_rate > 0:
+                                next_time += 1.0 / shot_rate
+                                self._stop_event.wait(max(0, next_time - time.time()))
+                            else:
+                                next_time = time.time()
+                        shot_channels.add(channel)
+
+                        master = self.application(self._tdest_base + channel)
+                        frame = master._reqFrame(len(payload), True)
+                        frame.write(bytearray(payload), 0)
+                        master._sendFrame(frame)
+                        self._frame_count += 1
+                        records += 1
+
+                    # Don't loop over a file without any valid record
+                    if not records:
+                        print("No records to replay in the capture file")
+                        break
+
+                    if not self.ReplayLoop.get():
+                        break
+                    f.seek(0)
+                    first_pass = False
+        except IOError as e:
+            print("Error replaying the capture file: {}".format(e))
+
+        print("Capture file replay stopped")
 
 class LocalServer(pyrogue.Root):
     """
     Local Server class. This class configure the whole rogue application.
     """
-    def __init__(self, ip_addr, config_file, server_mode, group_name, epics_prefix,\
+    def __init__(self, ip_addr, config_file, group_name, epics_prefix,\
         polling_en, comm_type, pcie_rssi_link, stream_pv_size, stream_pv_type,\
-        pv_dump_file):
+        pv_dump_file, stream_pv_channels=1, stream_pv_header_size=0, replay_file='',
+        replay_rate=1.0, tuning=None, metrics_en=False, output_dir='/tmp', ring_depth=0,
+        pcie_card=None, recovery_checks=3):
 
         try:
             pyrogue.Root.__init__(self, name='AMCc', description='AMC Carrier')
 
+            # Server metrics
+            self.metrics = ServerMetrics()
+            self.metrics.describe('thread_cpu_seconds_total', 'counter',
+                'CPU time used by each thread')
+            self.metrics.describe('stream_frames_total', 'counter',
+                'Number of frames received on each stream')
+            self.metrics.describe('stream_bytes_total', 'counter',
+                'Number of bytes received on each stream')
+            self.metrics.describe('poll_cycle_seconds', 'summary',
+                'Duration of the poll cycles')
+            self.metrics.describe('epics_clients', 'gauge',
+                'Number of clients connected to the EPICS server')
+            self.metrics.describe('register_latency_seconds', 'summary',
+                'Latency of the register transactions done by the health checks')
+            self.metrics.describe('register_errors_total', 'counter',
+                'Number of failed register transactions')
+            self.metrics.describe('link_up', 'gauge',
+                'Status of the FPGA link, according to the last health check')
+            self.metrics.describe('rssi_open', 'gauge',
+                'Status of the RSSI connections')
+            self.metrics.describe('rssi_down_total', 'counter',
+                'Number of times the RSSI connections went down')
+            self.metrics.describe('rssi_dropped_total', 'counter',
+                'Number of frames dropped by the RSSI connections')
+            self.metrics.describe('rssi_retransmitted_total', 'counter',
+                'Number of frames retransmitted by the RSSI connections')
+            self.metrics.describe('stream_tap_active', 'gauge',
+                'Status of the demand-driven taps of the stream data PVs')
+            self.metrics.describe('read_cache_hits_total', 'counter',
+                'Number of variable reads served from the cache')
+            self.metrics.describe('read_cache_misses_total', 'counter',
+                'Number of variable reads which generated a hardware transaction')
+            self.metrics.describe('read_coalesced_total', 'counter',
+                'Number of variable reads which shared an in-flight hardware transaction')
+            self.metrics.describe('variable_read_seconds', 'summary',
+                'Duration of the hardware reads of variables')
+            self.metrics.describe('write_coalesced_total', 'counter',
+                'Number of variable writes replaced by a later write')
+            self.metrics.describe('write_flushed_total', 'counter',
+                'Number of coalesced variable writes sent to the hardware')
+            self.metrics.describe('monitor_suppressed_total', 'counter',
+                'Number of variable updates not published to the EPICS server')
+            self.metrics.describe('link_recoveries_total', 'counter',
+                'Number of FPGA link recovery attempts')
+            self.metrics.describe('link_recovery_failures_total', 'counter',
+                'Number of failed FPGA link recovery attempts')
+            self.metrics.describe('link_recovery_seconds', 'summary',
+                'Duration of the successful FPGA link recoveries')
+            self.metrics.add_collector(self._collect_metrics)
+
+            # Cached status of the FPGA link, updated by check_health()
+            self._health_lock = threading.Lock()
+            self._health = {
+                'link_ok': None,
+                'last_check': None,
+                'last_ok': None,
+                'latency': None,
+                'checks': 0,
+                'errors': 0,
+                'consecutive_errors': 0,
+                'last_error': '',
+                'uptime': None,
+                'recoveries': 0,
+                'last_recovery': None,
+                'snapshot_time': None}
+
+            # Link recovery. The configuration snapshot restored after the
+            # link is reopened is refreshed by check_health() while the link is up.
+            self._pcie_card = pcie_card
+            self._recovery_checks = recovery_checks
+            self._recovery_lock = threading.Lock()
+            self._rssi_links = None
+            self._snapshot = None
+            self._snapshot_dirty = False
+
             # File writer for streaming interfaces
             # DDR interface (TDEST 0x80 - 0x87)
             stm_data_writer = pyrogue.utilities.fileio.StreamWriter(name='streamDataWriter')
@@ -230,14 +2164,19 @@ class LocalServer(pyrogue.Root):
             stm_interface_writer = pyrogue.utilities.fileio.StreamWriter(name='streamingInterface')
             self.add(stm_interface_writer)
 
-            # Workaround to FpgaTopLelevel not supporting rssi = None
-            if pcie_rssi_link == None:
-                pcie_rssi_link = 0
+            self._replay_en = bool(replay_file)
+            if self._replay_en:
+                # Replay a capture file in place of the FpgaTopLevel streams
+                fpga = CaptureReplay(file_name=replay_file, rate=replay_rate)
+            else:
+                # Workaround to FpgaTopLelevel not supporting rssi = None
+                if pcie_rssi_link == None:
+                    pcie_rssi_link = 0
 
-            # Instantiate Fpga top level
-            fpga = FpgaTopLevel(ipAddr=ip_addr,
-                commType=comm_type,
-                pcieRssiLink=pcie_rssi_link)
+                # Instantiate Fpga top level
+                fpga = FpgaTopLevel(ipAddr=ip_addr,
+                    commType=comm_type,
+                    pcieRssiLink=pcie_rssi_link)
 
             # Add devices
             self.add(fpga)
@@ -251,53 +2190,418 @@ class LocalServer(pyrogue.Root):
                 pyrogue.streamConnect(fpga.stream.application(0xC0 + i),
                  stm_interface_writer.getChannel(i))
 
-            # Run control for streaming interfaces
-            self.add(pyrogue.RunControl(
-                name='streamRunControl',
-                description='Run controller',
-                cmd=fpga.SwDaqMuxTrig,
-                rates={
-                    1:  '1 Hz',
-                    10: '10 Hz',
-                    30: '30 Hz'}))
-
-            # PVs for stream data, used on PCAS-based EPICS server
+            # Count the frames received on each stream, for the metrics
+            if metrics_en:
+                self._frame_counters = []
+                for i in range(8):
+                    for stream, tdest in (('ddr', 0x80), ('interface', 0xC0)):
+                        frame_counter = FrameCounter(self.metrics, stream, i)
+                        pyrogue.streamTap(fpga.stream.application(tdest + i), frame_counter)
+                        self._frame_counters.append(frame_counter)
+
+            # Memory budget shared by the ring buffers and the acquisition blocks
+            self._memory_budget = MemoryBudget()
+
+            # Decoders of the DDR streams, shared by all their users
+            self._decoders = [FrameDecoder(data_type=stream_pv_type, channels=stream_pv_channels,
+                header_size=stream_pv_header_size) for i in range(8)]
+
+            # Ring buffers with the last frames of each DDR stream
+            self._output_dir = output_dir
+            self._frame_rings = []
+            if ring_depth:
+                ring_size = stream_pv_size if stream_pv_size else FrameRing.default_size
+                print("Enabling stream ring buffers (depth = {} frames, size = {} points)"\
+                    .format(ring_depth, ring_size))
+
+                for i in range(8):
+                    frame_ring = FrameRing(depth=ring_depth, size=ring_size,
+                        decoder=self._decoders[i], budget=self._memory_budget)
+
+                    # Setup a FIFO tapped to the stream data, trimmed to the ring frame size
+                    ring_fifo = rogue.interfaces.stream.Fifo(0,
+                        self._decoders[i].max_frame_bytes(ring_size))
+                    ring_fifo._setSlave(frame_ring)
+                    self._frame_rings.append(frame_ring)
+
+                    # The ring is only fed while its depth is not zero
+                    ring_tap = StreamTap(fpga.stream.application(0x80 + i), ring_fifo)
+                    ring_tap.subscribe('ring')
+
+                    def set_ring_depth(dev, var, value, frame_ring=frame_ring, ring_tap=ring_tap):
+                        frame_ring.set_depth(dev, var, value)
+                        if frame_ring.get_depth():
+                            ring_tap.subscribe('ring')
+                        else:
+                            ring_tap.unsubscribe('ring')
+
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamRingDepth{}'.format(i),
+                        description='Number of frames kept in the ring buffer of stream {}'.format(i),
+                        mode='RW',
+                        value=ring_depth,
+                        localSet=set_ring_depth,
+                        localGet=frame_ring.get_depth,
+                        hidden=True))
+
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamRingFill{}'.format(i),
+                        description='Number of frames in the ring buffer of stream {}'.format(i),
+                        mode='RO',
+                        value=0,
+                        localGet=frame_ring.get_fill,
+                        pollInterval=1,
+                        hidden=True))
+
+                self.add(pyrogue.LocalCommand(
+                    name='StreamRingDump',
+                    description='Dump the stream ring buffers to a file in the output directory',
+                    function=self.dump_frame_rings))
+
+            # Run control for streaming interfaces. When replaying a capture
+            # file, the frames are always being received.
+            if self._replay_en:
+                acq_trigger = None
+                acq_is_running = lambda: True
+            else:
+                self.add(pyrogue.RunControl(
+                    name='streamRunControl',
+                    description='Run controller',
+                    cmd=fpga.SwDaqMuxTrig,
+                    rates={
+                        1:  '1 Hz',
+                        10: '10 Hz',
+                        30: '30 Hz'}))
+                acq_trigger = fpga.SwDaqMuxTrig
+                acq_is_running = lambda: self.streamRunControl.runState.getDisp() == 'Running'
+
+            # Statistics and spectrum of the DDR streams, computed only
+            # while enabled
+            stats_size = stream_pv_size if stream_pv_size else FrameRing.default_size
+            for i in range(8):
+                stream_stats = StreamStats(size=stats_size, decoder=self._decoders[i])
+                stats_fifo = rogue.interfaces.stream.Fifo(0,
+                    self._decoders[i].max_frame_bytes(stats_size))
+                stats_fifo._setSlave(stream_stats)
+                stats_tap = StreamTap(fpga.stream.application(0x80 + i), stats_fifo)
+
+                def set_stats_enable(dev, var, value, stats_tap=stats_tap):
+                    if value:
+                        stats_tap.subscribe('stats')
+                    else:
+                        stats_tap.unsubscribe('stats')
+
+                self.add(pyrogue.LocalVariable(
+                    name='StreamStatsEnable{}'.format(i),
+                    description='Enable the statistics of stream {}'.format(i),
+                    mode='RW',
+                    value=False,
+                    localSet=set_stats_enable,
+                    localGet=stats_tap.is_active,
+                    hidden=True))
+
+                if stream_pv_channels > 1:
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamStatsChannel{}'.format(i),
+                        description='Interleaved channel of stream {} used for the statistics'.format(i),
+                        mode='RW',
+                        value=0,
+                        localSet=stream_stats.set_channel,
+                        localGet=stream_stats.get_channel,
+                        hidden=True))
+
+                self.add(pyrogue.LocalVariable(
+                    name='StreamSampleRate{}'.format(i),
+                    description='Sample rate of stream {}, in Hz'.format(i),
+                    mode='RW',
+                    value=1.0,
+                    localSet=stream_stats.set_sample_rate,
+                    localGet=stream_stats.get_sample_rate,
+                    hidden=True))
+
+                self.add(pyrogue.LocalVariable(
+                    name='StreamSpectrumLength{}'.format(i),
+                    description='Number of points of the stream {} spectrum segments.'.format(i) +
+                        ' Zero disables the spectrum, otherwise it must be at least 3',
+                    mode='RW',
+                    value=0,
+                    localSet=stream_stats.set_spectrum_length,
+                    localGet=stream_stats.get_spectrum_length,
+                    hidden=True))
+
+                self.add(pyrogue.LocalVariable(
+                    name='StreamSpectrumAverages{}'.format(i),
+                    description='Number of frames averaged in the stream {} spectrum'.format(i),
+                    mode='RW',
+                    value=1,
+                    localSet=stream_stats.set_spectrum_averages,
+                    localGet=stream_stats.get_spectrum_averages,
+                    hidden=True))
+
+                stats_vars = []
+                for stat_name, stat_var_name, stat_description in [
+                    ('mean', 'StreamMean', 'Mean value'),
+                    ('rms', 'StreamRms', 'RMS value'),
+                    ('peak_to_peak', 'StreamPeakToPeak', 'Peak-to-peak value'),
+                    ('peak_frequency', 'StreamPeakFrequency', 'Dominant frequency, in Hz,')]:
+                    stats_vars.append(pyrogue.LocalVariable(
+                        name='{}{}'.format(stat_var_name, i),
+                        description='{} of stream {}'.format(stat_description, i),
+                        mode='RO',
+                        value=0.0,
+                        localGet=lambda stream_stats=stream_stats, stat_name=stat_name:\
+                            stream_stats.get_value(stat_name),
+                        hidden=True))
+
+                stats_vars.append(pyrogue.LocalVariable(
+                    name='StreamSpectrum{}'.format(i),
+                    description='Power spectral density of stream {}'.format(i),
+                    mode='RO',
+                    value=np.zeros(stats_size // 2 + 1),
+                    localGet=stream_stats.get_spectrum,
+                    update=False,
+                    hidden=True))
+
+                for stats_var in stats_vars:
+                    self.add(stats_var)
+
+                # Update the statistics variables after each frame
+                stream_stats.set_callback(lambda stats_vars=stats_vars:\
+                    [v.updated() for v in stats_vars])
+
+            # Triggered acquisition engine for the DDR streams
+            self._acquisition = TriggeredAcquisition(
+                streams=[fpga.stream.application(0x80 + i) for i in range(8)],
+                decoders=self._decoders,
+                size=stream_pv_size if stream_pv_size else FrameRing.default_size,
+                trigger=acq_trigger,
+                is_running=acq_is_running,
+                output_dir=output_dir,
+                budget=self._memory_budget)
+
+            self.add(pyrogue.LocalVariable(
+                name='StreamAcqFrames',
+                description='Number of consecutive frames to acquire on each stream',
+                mode='RW',
+                value=10))
+
+            self.add(pyrogue.LocalVariable(
+                name='StreamAcqChannelMask',
+                description='Mask of the streams to acquire',
+                mode='RW',
+                value=0xFF))
+
+            self.add(pyrogue.LocalVariable(
+                name='StreamAcqTimeout',
+                description='Maximum time to wait for each frame, in seconds',
+                mode='RW',
+                value=1.0))
+
+            self.add(pyrogue.LocalVariable(
+                name='StreamAcqSaveFile',
+                description='Write the acquired data to a file in the output directory',
+                mode='RW',
+                value=False))
+
+            acq_vars = []
+            acq_vars.append(pyrogue.LocalVariable(
+                name='StreamAcqState',
+                description='State of the last acquisition',
+                mode='RO',
+                value=0,
+                enum={i:j for i,j in enumerate(TriggeredAcquisition.states)},
+                localGet=self._acquisition.get_state))
+
+            acq_vars.append(pyrogue.LocalVariable(
+                name='StreamAcqId',
+                description='ID of the last accepted acquisition',
+                mode='RO',
+                value=0,
+                localGet=self._acquisition.get_id))
+
+            acq_vars.append(pyrogue.LocalVariable(
+                name='StreamAcqFile',
+                description='File with the last acquired data',
+                mode='RO',
+                value='',
+                localGet=self._acquisition.get_last_file))
+
+            self.add(pyrogue.LocalVariable(
+                name='StreamAcqMaxFrames',
+                description='Maximum number of frames of an acquisition',
+                mode='RO',
+                value=TriggeredAcquisition.max_frames,
+                localGet=self._acquisition.get_max_frames))
+
+            # The array variables are declared with their maximum size
+            acq_size = (stream_pv_size if stream_pv_size else FrameRing.default_size) * stream_pv_channels
+            acq_stream_vars = []
+            for i in range(8):
+                acq_stream_vars.append([])
+                acq_stream_vars[i].append(pyrogue.LocalVariable(
+                    name='StreamAcqData{}'.format(i),
+                    description='Frames acquired on stream {}, concatenated'.format(i),
+                    mode='RO',
+                    value=np.zeros(TriggeredAcquisition.max_frames * acq_size,
+                        dtype=self._decoders[i].get_dtype()),
+                    localGet=lambda i=i: self._acquisition.get_data(i),
+                    update=False,
+                    hidden=True))
+
+                acq_stream_vars[i].append(pyrogue.LocalVariable(
+                    name='StreamAcqTimestamps{}'.format(i),
+                    description='Timestamps of the frames acquired on stream {}'.format(i),
+                    mode='RO',
+                    value=np.zeros(TriggeredAcquisition.max_frames, dtype=np.float64),
+                    localGet=lambda i=i: self._acquisition.get_timestamps(i),
+                    update=False,
+                    hidden=True))
+
+                acq_stream_vars[i].append(pyrogue.LocalVariable(
+                    name='StreamAcqSequence{}'.format(i),
+                    description='Numbers of the frames acquired on stream {}, counted across the acquisitions'.format(i),
+                    mode='RO',
+                    value=np.zeros(TriggeredAcquisition.max_frames, dtype=np.uint64),
+                    localGet=lambda i=i: self._acquisition.get_sequence(i),
+                    update=False,
+                    hidden=True))
+
+            for acq_var in acq_vars + [v for stream_vars in acq_stream_vars for v in stream_vars]:
+                self.add(acq_var)
+
+            # Update the readback variables when the acquisition state changes,
+            # only for the streams whose data changed
+            self._acquisition.set_callback(lambda channels:\
+                [v.updated() for v in acq_vars + [v for i in channels for v in acq_stream_vars[i]]])
+
+            self.add(pyrogue.LocalCommand(
+                name='StreamAcqStart',
+                description='Start an acquisition',
+                function=lambda: self._acquisition.start(
+                    frames=self.StreamAcqFrames.get(),
+                    channel_mask=self.StreamAcqChannelMask.get(),
+                    timeout=self.StreamAcqTimeout.get(),
+                    save_file=self.StreamAcqSaveFile.get())))
+
+            # Demand-driven taps for the stream data PVs. The data is only
+            # copied and decoded while the tap is enabled or, in the PCAS-based
+            # EPICS server, while the stream PV is being read. The EPICS servers
+            # do not tell when their PVs are monitored, so the taps are enabled
+            # by default, and the PCAS-based server clients which only read the
+            # PVs can opt in to the demand-driven mode by disabling them. The
+            # taps of the GDD-based server, which are not read, are kept active.
+            self._stream_taps = []
             if epics_prefix and stream_pv_size:
-                if use_pcas:
+                for i in range(8):
+                    stream_tap = StreamTap(fpga.stream.application(0x80 + i))
+                    stream_tap.set_enable(None, None, True)
+                    if not use_pcas:
+                        stream_tap.subscribe('epics')
+                    self._stream_taps.append(stream_tap)
+
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamEnable{}'.format(i),
+                        description='Always update the stream {} data PV'.format(i),
+                        mode='RW',
+                        value=True,
+                        localSet=stream_tap.set_enable,
+                        localGet=stream_tap.get_enable,
+                        hidden=True))
+
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamActive{}'.format(i),
+                        description='Stream {} data PV is being updated'.format(i),
+                        mode='RO',
+                        value=False,
+                        localGet=stream_tap.is_active,
+                        pollInterval=1,
+                        hidden=True))
+
+                    self.add(pyrogue.LocalVariable(
+                        name='StreamFrameCount{}'.format(i),
+                        description='Number of frames decoded for the stream {} data PV'.format(i),
+                        mode='RO',
+                        value=0,
+                        localGet=stream_tap.get_frame_count,
+                        pollInterval=1,
+                        hidden=True))
+
+                # Thread used to expire the read leases of the taps
+                stream_tap_thread = threading.Thread(target=self._stream_tap_worker,
+                    name='StreamTaps', daemon=True)
+                stream_tap_thread.start()
+
+            # PVs for stream data, used on PCAS-based EPICS server. They are also
+            # used on the GDD-based EPICS server when the frames have a header,
+            # interleaved channels, or a data type its native stream slaves can not
+            # decode.
+            self._use_data_buffer = False
+            if epics_prefix and stream_pv_size:
+                self._use_data_buffer = use_pcas or stream_pv_channels > 1 or\
+                    stream_pv_header_size or stream_pv_type not in gdd_stream_data_types
+                if self._use_data_buffer:
 
-                    print("Enabling stream data on PVs (buffer size = {} points, data type = {})"\
-                        .format(stream_pv_size,stream_pv_type))
+                    print("Enabling stream data on PVs (buffer size = {} points, data type = {},"\
+                        .format(stream_pv_size,stream_pv_type),
+                        "channels = {}, header size = {} bytes)"\
+                        .format(stream_pv_channels,stream_pv_header_size))
 
                     # Add data streams (0-7) to local variables so they are expose as PVs
                     # Also add PVs to select the data format
                     for i in range(8):
 
-                        # Calculate number of bytes needed on the fifo
-                        if '16' in stream_pv_type:
-                            fifo_size = stream_pv_size * 2
-                        else:
-                            fifo_size = stream_pv_size * 4
-
                         # Setup a FIFO tapped to the stream data and a Slave data buffer
-                        # Local variables will talk to the data buffer directly.
-                        stream_fifo = rogue.interfaces.stream.Fifo(0, fifo_size)
-                        data_buffer = DataBuffer(size=stream_pv_size, data_type=stream_pv_type)
+                        # Local variables will talk to the data buffer directly, and the
+                        # data format variables to the stream decoder.
+                        decoder = self._decoders[i]
+                        stream_fifo = rogue.interfaces.stream.Fifo(0,
+                            decoder.max_frame_bytes(stream_pv_size))
+                        data_buffer = DataBuffer(size=stream_pv_size, decoder=decoder)
                         stream_fifo._setSlave(data_buffer)
 
-                        pyrogue.streamTap(fpga.stream.application(0x80 + i), stream_fifo)
+                        stream_tap = self._stream_taps[i]
+                        stream_tap.set_consumer(stream_fifo)
 
                         # Variable to read the stream data
                         stream_var = pyrogue.LocalVariable(
                             name='Stream{}'.format(i),
                             description='Stream {}'.format(i),
                             mode='RO',
-                            value=0,
-                            localGet=data_buffer.read,
+                            value=np.zeros(stream_pv_size * stream_pv_channels, dtype=decoder.get_dtype()),
+                            localGet=data_buffer.read_frame,
                             update=False,
                             hidden=True)
 
-                        # Set the buffer callback to update the variable
-                        data_buffer.set_callback(stream_var.updated)
+                        # Variables to read the data of each interleaved channel
+                        channel_vars = []
+                        if stream_pv_channels > 1:
+                            for j in range(stream_pv_channels):
+                                channel_vars.append(pyrogue.LocalVariable(
+                                    name='Stream{}Ch{}'.format(i, j),
+                                    description='Stream {}, interleaved channel {}'.format(i, j),
+                                    mode='RO',
+                                    value=np.zeros(stream_pv_size, dtype=decoder.get_dtype()),
+                                    localGet=lambda j=j, read=data_buffer.read: read(j),
+                                    update=False,
+                                    hidden=True))
+
+                        # Explicit reads of the data keep the tap active
+                        for var in [stream_var] + channel_vars:
+                            stream_tap.lease_on_read(var)
+
+                        # Set the buffer callback to update the variables
+                        data_buffer.set_callback(lambda stream_var=stream_var, channel_vars=channel_vars:\
+                            [v.updated() for v in [stream_var] + channel_vars])
+
+                        # Variable to read the header size. It is fixed at startup, as it
+                        # sets the size of the stream FIFOs and buffers.
+                        header_size_var = pyrogue.LocalVariable(
+                            name='StreamHeaderSize{}'.format(i),
+                            description='Size, in bytes, of the frame header being skipped',
+                            mode='RO',
+                            value=stream_pv_header_size,
+                            localGet=decoder.get_header_size,
+                            hidden=True)
 
                         # Variable to set the data format
                         data_format_var = pyrogue.LocalVariable(
@@ -305,9 +2609,9 @@ class LocalServer(pyrogue.Root):
                             description='Type of data being unpacked',
                             mode='RW',
                             value=0,
-                            enum={i:j for i,j in enumerate(data_buffer.get_data_format_list())},
-                            localSet=data_buffer.set_data_format,
-                            localGet=data_buffer.get_data_format,
+                            enum={i:j for i,j in enumerate(decoder.get_data_format_list())},
+                            localSet=decoder.set_data_format,
+                            localGet=decoder.get_data_format,
                             hidden=True)
 
                         # Variable to set the data byte order
@@ -316,9 +2620,9 @@ class LocalServer(pyrogue.Root):
                             description='Byte order of data being unpacked',
                             mode='RW',
                             value=0,
-                            enum={i:j for i,j in enumerate(data_buffer.get_data_byte_order_list())},
-                            localSet=data_buffer.set_data_byte_order,
-                            localGet=data_buffer.get_data_byte_order,
+                            enum={i:j for i,j in enumerate(decoder.get_data_byte_order_list())},
+                            localSet=decoder.set_data_byte_order,
+                            localGet=decoder.get_data_byte_order,
                             hidden=True)
 
                         # Variable to read the data format string
@@ -327,7 +2631,7 @@ class LocalServer(pyrogue.Root):
                             description='Format string used to unpack the data',
                             mode='RO',
                             value=0,
-                            localGet=data_buffer.get_data_format_string,
+                            localGet=decoder.get_data_format_string,
                             hidden=True)
 
                         # Add listener to update the format string readback variable
@@ -337,6 +2641,9 @@ class LocalServer(pyrogue.Root):
 
                         # Add the local variable to self
                         self.add(stream_var)
+                        for channel_var in channel_vars:
+                            self.add(channel_var)
+                        self.add(header_size_var)
                         self.add(data_format_var)
                         self.add(byte_order_var)
                         self.add(format_string_var)
@@ -354,6 +2661,111 @@ class LocalServer(pyrogue.Root):
                 description='Set default configuration',
                 function=self.set_defaults_cmd))
 
+            # Sampling profiler of the server threads. It can be started from
+            # any client while the server is running, without restarting it.
+            self._profiler = SamplingProfiler(output_dir=output_dir)
+
+            self.add(pyrogue.LocalVariable(
+                name='profilerDuration',
+                description='Profiler duration, in seconds',
+                mode='RW',
+                value=10))
+
+            profiler_running_var = pyrogue.LocalVariable(
+                name='profilerRunning',
+                description='Profiler running status',
+                mode='RO',
+                value=False,
+                localGet=self._profiler.is_running)
+            self.add(profiler_running_var)
+
+            profiler_file_var = pyrogue.LocalVariable(
+                name='profilerOutputFile',
+                description='File with the last profiler results',
+                mode='RO',
+                value='',
+                localGet=self._profiler.get_last_file)
+            self.add(profiler_file_var)
+
+            self._profiler.set_callback(lambda: [profiler_running_var.updated(),
+                profiler_file_var.updated()])
+
+            self.add(pyrogue.LocalCommand(
+                name='startProfiler',
+                description='Start the sampling profiler for profilerDuration seconds',
+                function=lambda: self._profiler.start(self.profilerDuration.get())))
+
+            self.add(pyrogue.LocalCommand(
+                name='stopProfiler',
+                description='Stop the sampling profiler',
+                function=self._profiler.stop))
+
+            # Single-flight layer for the hardware-backed variable reads
+            self._tuning = tuning if tuning else {}
+            self._read_coalescer = ReadCoalescer(self.metrics)
+
+            self.add(pyrogue.LocalVariable(
+                name='ReadCacheHits',
+                description='Number of variable reads served from the cache',
+                mode='RO',
+                value=0,
+                localGet=self._read_coalescer.get_hits,
+                pollInterval=1))
+
+            self.add(pyrogue.LocalVariable(
+                name='ReadCacheMisses',
+                description='Number of variable reads which generated a hardware transaction',
+                mode='RO',
+                value=0,
+                localGet=self._read_coalescer.get_misses,
+                pollInterval=1))
+
+            self.add(pyrogue.LocalVariable(
+                name='ReadCoalesced',
+                description='Number of variable reads which shared an in-flight hardware transaction',
+                mode='RO',
+                value=0,
+                localGet=self._read_coalescer.get_coalesced,
+                pollInterval=1))
+
+            # Write coalescing stage for the hardware-backed variables
+            self._write_coalescer = WriteCoalescer(self.metrics)
+
+            self.add(pyrogue.LocalVariable(
+                name='WritesCoalesced',
+                description='Number of variable writes replaced by a later write',
+                mode='RO',
+                value=0,
+                localGet=self._write_coalescer.get_coalesced,
+                pollInterval=1))
+
+            self.add(pyrogue.LocalVariable(
+                name='WritesPending',
+                description='Number of coalesced variable writes waiting to be sent to the hardware',
+                mode='RO',
+                value=0,
+                localGet=self._write_coalescer.get_pending,
+                pollInterval=1))
+
+            # The configuration snapshot is only kept up to date when the link recovery is enabled
+            if recovery_checks and not self._replay_en:
+                self.add(pyrogue.LocalCommand(
+                    name='RecoverLink',
+                    description='Reopen the FPGA link and restore the current configuration',
+                    function=lambda: self.recover_link()))
+
+            # Deadband and minimum interval filter for the EPICS monitors
+            self._monitor_filter = MonitorFilter(self.metrics, self._tuning.get('MonitorFilter', {}))
+
+            if epics_prefix:
+                self.add(pyrogue.LocalVariable(
+                    name='MonitorUpdatesSuppressed',
+                    description='Number of variable updates not published to the EPICS server',
+                    mode='RO',
+                    value=0,
+                    localGet=self._monitor_filter.get_suppressed,
+                    pollInterval=1))
+
             # Start the root
             if group_name:
                 # Start with Pyro4 server
@@ -365,7 +2777,24 @@ class LocalServer(pyrogue.Root):
                 print("Starting rogue server")
                 self.start(pollEn=polling_en)
 
+            remote_vars = [v for v in self.variableList if isinstance(v, pyrogue.RemoteVariable)
+                and not isinstance(v, pyrogue.BaseCommand)]
+            self._write_coalescer.install(remote_vars, self._tuning.get('WriteCoalescing', {}))
+            self._read_coalescer.install(remote_vars, self._tuning.get('ReadCache', {}))
+
+            # Writes to the FpgaTopLevel variables make the configuration snapshot outdated
+            if recovery_checks and not self._replay_en:
+                for var in remote_vars:
+                    if var.path.startswith(self.FpgaTopLevel.path + '.'):
+                        set = var.set
+                        var.set = functools.wraps(set)(
+                            lambda *args, set=set, **kwargs: self._set_snapshot_dirty(set, *args, **kwargs))
+
             self.ReadAll()
+            self.take_snapshot()
+
+            if self._replay_en:
+                self.CaptureReplay.start_replay()
 
         except KeyboardInterrupt:
             print("Killing server creation...")
@@ -388,17 +2817,23 @@ class LocalServer(pyrogue.Root):
         print("")
 
         # Start the EPICS server
+        self._epics_port = None
         if epics_prefix:
+            self._epics_port = int(os.environ.get('EPICS_CA_SERVER_PORT', 5064))
             print("Starting EPICS server using prefix \"{}\"".format(epics_prefix))
 
+            self._monitor_filter.install(
+                [v for v in self.variableList if not isinstance(v, pyrogue.BaseCommand)])
+
             # Choose the appropriate epics module:
-            if use_pcas:
-                self.epics = pyrogue.epics.EpicsCaServer(base=epics_prefix, root=self)
-            else:
-                self.epics = pyrogue.protocols.epics.EpicsCaServer(base=epics_prefix, root=self)
+            with self._monitor_filter.capture():
+                if use_pcas:
+                    self.epics = pyrogue.epics.EpicsCaServer(base=epics_prefix, root=self)
+                else:
+                    self.epics = pyrogue.protocols.epics.EpicsCaServer(base=epics_prefix, root=self)
 
                 # PVs for stream data, used on GDD-based EPICS server
-                if stream_pv_size:
+                if stream_pv_size and not self._use_data_buffer:
 
                     print("Enabling stream data on PVs (buffer size = {} points, data type = {})"\
                         .format(stream_pv_size,stream_pv_type))
@@ -414,9 +2849,10 @@ class LocalServer(pyrogue.Root):
 
                         stream_fifo = rogue.interfaces.stream.Fifo(0, fifo_size)
                         stream_fifo._setSlave(stream_slave)
-                        pyrogue.streamTap(fpga.stream.application(0x80+i), stream_fifo)
+                        self._stream_taps[i].set_consumer(stream_fifo)
 
-            self.epics.start()
+            with self._monitor_filter.capture():
+                self.epics.start()
 
             # Dump the PV list to the specified file
             if pv_dump_file:
@@ -441,20 +2877,6 @@ class LocalServer(pyrogue.Root):
                             # Capture error from epics.dump() if any
                             print("Errors were found during epics.dump()")
 
-        # If no in server Mode, start the GUI
-        if not server_mode:
-            create_gui(self)
-        else:
-            # Stop the server when Crtl+C is pressed
-            print("")
-            print("Running in server mode now. Press Ctrl+C to stop...")
-            try:
-                # Wait for Ctrl+C
-                while True:
-                    time.sleep(1)
-            except KeyboardInterrupt:
-                pass
-
     # Function for setting a default configuration.
     def set_defaults_cmd(self):
         # Check if a default configuration file has been defined
@@ -463,15 +2885,460 @@ class LocalServer(pyrogue.Root):
             return
 
         print('Setting defaults from file {}'.format(self.config_file))
+        self._write_coalescer.flush()
         self.ReadConfig(self.config_file)
+        self.take_snapshot()
+
+    def _stream_tap_worker(self):
+        while True:
+            for stream_tap in self._stream_taps:
+                stream_tap.update()
+            time.sleep(1)
+
+    def dump_frame_rings(self):
+        """
+        Function to dump the content of the stream ring buffers to a numpy
+        ".npz" file in the output directory. For each stream "i", the file
+        contains the arrays "data{i}", "lengths{i}", "timestamps{i}" and
+        "sequence{i}".
+        """
+        arrays = {}
+        for i, frame_ring in enumerate(self._frame_rings):
+            for name, array in frame_ring.get_snapshot().items():
+                arrays['{}{}'.format(name, i)] = array
+
+        file_name = os.path.join(self._output_dir,
+            'stream_ring_{}.npz'.format(time.strftime('%Y%m%d_%H%M%S')))
+        try:
+            np.savez(file_name, **arrays)
+        except IOError as e:
+            print("Could not write the ring buffer dump: {}".format(e))
+        else:
+            print("Ring buffers dumped to \"{}\"".format(file_name))
+
+    def check_health(self):
+        """
+        Function to check the health of the FPGA link. It reads the FPGA
+        version register and records the outcome and the round trip time.
+        """
+        # There is no FPGA link when replaying a capture file
+        if self._replay_en:
+            return
+
+        # Don't check the link while it is being recovered
+        if self._recovery_lock.locked():
+            return
+
+        # The registers are read from the hardware, not from the read cache
+        axi_version = self.FpgaTopLevel.AmcCarrierCore.AxiVersion
+        start = time.time()
+        try:
+            self._read_coalescer.read(axi_version.FpgaVersion)
+            latency = time.time() - start
+
+            # The uptime counter going backwards means the FPGA was rebooted
+            uptime = self._read_coalescer.read(axi_version.UpTimeCnt)\
+                if hasattr(axi_version, 'UpTimeCnt') else None
+        except Exception as e:
+            self.metrics.inc('register_errors_total')
+            with self._health_lock:
+                self._health['link_ok'] = False
+                self._health['errors'] += 1
+                self._health['consecutive_errors'] += 1
+                self._health['last_error'] = str(e)
+                lost = self._recovery_checks and \
+                    self._health['consecutive_errors'] >= self._recovery_checks
+                rebooted = False
+        else:
+            self.metrics.observe('register_latency_seconds', latency)
+            with self._health_lock:
+                self._health['link_ok'] = True
+                self._health['last_ok'] = time.time()
+                self._health['latency'] = latency
+                self._health['consecutive_errors'] = 0
+                last_uptime, self._health['uptime'] = self._health['uptime'], uptime
+                rebooted = self._recovery_checks and None not in (uptime, last_uptime) \
+                    and uptime < last_uptime
+                lost = False
+        finally:
+            with self._health_lock:
+                self._health['checks'] += 1
+                self._health['last_check'] = time.time()
+
+        if lost:
+            print("The FPGA link is down")
+            self.recover_link()
+        elif rebooted:
+            print("The FPGA was rebooted")
+            self.recover_link(rebooted=True)
+        elif self._recovery_checks and (self._snapshot_dirty or
+            time.time() - (self._health['snapshot_time'] or 0) > self.snapshot_period):
+            self.take_snapshot()
+
+    # Maximum time, in seconds, between the configuration snapshots taken by check_health().
+    # The snapshot is also taken by each health check following a write.
+    snapshot_period = 60.0
+
+    # Time, in seconds, to wait for the RSSI links to open during the link recovery
+    recovery_timeout = 10.0
+
+    def take_snapshot(self):
+        """
+        Function to take a snapshot of the FPGA configuration. It contains
+        the last values written to, or read from, the FpgaTopLevel variables,
+        so no register transaction is done.
+        """
+        if self._replay_en:
+            return
+
+        # Writes done while the snapshot is taken mark it outdated again
+        self._snapshot_dirty = False
+        try:
+            # Keep the values in their display format
+            config = yaml.load(self.getYaml(readFirst=False, modes=['RW', 'WO']),
+                Loader=yaml.BaseLoader)
+            self._snapshot = yaml.safe_dump(
+                {self.name: {'FpgaTopLevel': config[self.name]['FpgaTopLevel']}},
+                default_flow_style=False)
+        except Exception as e:
+            print("Error taking the configuration snapshot: {}".format(e))
+            return
+
+        with self._health_lock:
+            self._health['snapshot_time'] = time.time()
+
+    def _set_snapshot_dirty(self, set, *args, **kwargs):
+        self._snapshot_dirty = True
+        return set(*args, **kwargs)
+
+    def recover_link(self, rebooted=False):
+        """
+        Function to recover the FPGA link in place. Polling is paused, the
+        RSSI link is reopened and, once the FPGA answers, the configuration
+        snapshot is restored using bulk writes. The EPICS and Pyro4 servers
+        are kept running.
+
+        Unless the FPGA was rebooted, the snapshot is first taken again from
+        the variable shadow values, which still hold the configuration
+        applied before the link was lost. After a reboot, the shadow values
+        of the polled variables can already hold the reset values, so the
+        last snapshot taken while the link was up is used instead.
+        """
+        if self._replay_en or not self._recovery_lock.acquire(blocking=False):
+            return False
+
+        if not rebooted:
+            self.take_snapshot()
+
+        print("Recovering the FPGA link...")
+        self.metrics.inc('link_recoveries_total')
+        start = time.time()
+        poll_en = self.PollEn.get()
+        try:
+            self.PollEn.set(False)
+
+            # Reopen the RSSI link on the PCIe card, and restart the RSSI clients
+            use_pcie = self._pcie_card is not None and self._pcie_card.use_pcie
+            if use_pcie:
+                self._pcie_card.close_rssi()
+                self._pcie_card.open_rssi()
+
+            rssi_links = self.get_rssi_links()
+            if not rssi_links and not use_pcie:
+                raise RuntimeError("No RSSI link found to reopen")
+
+            for rssi in rssi_links:
+                if hasattr(rssi, 'stop') and hasattr(rssi, 'start'):
+                    rssi.stop()
+                    rssi.start()
+
+            while not all(rssi.getOpen() for rssi in rssi_links):
+                if time.time() - start > self.recovery_timeout:
+                    raise TimeoutError("RSSI link not open after {} s".format(self.recovery_timeout))
+                time.sleep(0.1)
+
+            # Check that the FPGA answers, reading the register from the hardware
+            self._read_coalescer.invalidate()
+            self._read_coalescer.read(self.FpgaTopLevel.AmcCarrierCore.AxiVersion.FpgaVersion)
+
+            # Restore the configuration snapshot, and read back the registers
+            self._write_coalescer.flush()
+            self._read_coalescer.invalidate()
+            if self._snapshot:
+                print("  Restoring the configuration snapshot...")
+                self.setYaml(self._snapshot, writeEach=False, modes=['RW', 'WO'])
+            self.ReadAll()
+        except Exception as e:
+            self.metrics.inc('link_recovery_failures_total')
+            print("  FPGA link recovery failed: {}".format(e))
+            return False
+        else:
+            duration = time.time() - start
+            self.metrics.observe('link_recovery_seconds', duration)
+            with self._health_lock:
+                self._health['link_ok'] = True
+                self._health['consecutive_errors'] = 0
+                self._health['uptime'] = None
+                self._health['recoveries'] += 1
+                self._health['last_recovery'] = time.time()
+            print("  FPGA link recovered in {:.1f} s".format(duration))
+            return True
+        finally:
+            self.PollEn.set(poll_en)
+            self._recovery_lock.release()
+
+    def get_health(self):
+        """
+        Function to get a copy of the last link health check results
+        """
+        with self._health_lock:
+            return dict(self._health)
+
+    def get_rssi_links(self):
+        """
+        Function to get the RSSI connection objects used by the FpgaTopLevel.
+        They are searched in the FpgaTopLevel, in all the devices under it,
+        and in the objects held by them (like the RSSI client of a UDP/RSSI
+        protocol device). The result is cached.
+        """
+        if self._replay_en:
+            return []
+
+        if self._rssi_links is None:
+            links = collections.OrderedDict()
+            nodes = [self.FpgaTopLevel]
+            for node in nodes:
+                for obj in [node] + list(vars(node).values()):
+                    if hasattr(obj, 'getOpen') and hasattr(obj, 'getDownCount'):
+                        links[id(obj)] = obj
+
+                devices = getattr(node, 'devices', {})
+                nodes.extend(devices.values() if isinstance(devices, dict) else devices)
+
+            if not links:
+                print("No RSSI link found in the FpgaTopLevel")
+            self._rssi_links = list(links.values())
+
+        return self._rssi_links
+
+    @contextlib.contextmanager
+    def updateGroup(self, *args, **kwargs):
+        """
+        Measure the duration of the poll cycles. The poll thread groups the
+        variable updates of each cycle using this context manager.
+        """
+        poll_thread = getattr(getattr(self, '_pollQueue', None), '_pollThread', None)
+        if threading.current_thread() is not poll_thread:
+            with super(LocalServer, self).updateGroup(*args, **kwargs):
+                yield
+            return
+
+        start = time.time()
+        try:
+            with super(LocalServer, self).updateGroup(*args, **kwargs):
+                yield
+        finally:
+            self.metrics.observe('poll_cycle_seconds', time.time() - start)
+
+    def _collect_metrics(self):
+        for (tid, name), cpu_time in get_thread_cpu_times().items():
+            self.metrics.set('thread_cpu_seconds_total', cpu_time, thread=name, tid=tid)
+
+        if self._epics_port:
+            self.metrics.set('epics_clients', get_tcp_client_count(self._epics_port))
+
+        link_ok = self.get_health()['link_ok']
+        if link_ok is not None:
+            self.metrics.set('link_up', int(link_ok))
+
+        for i, stream_tap in enumerate(self._stream_taps):
+            self.metrics.set('stream_tap_active', int(stream_tap.is_active()), channel=i)
+
+        for i, rssi in enumerate(self.get_rssi_links()):
+            self.metrics.set('rssi_open', int(rssi.getOpen()), link=i)
+            self.metrics.set('rssi_down_total', rssi.getDownCount(), link=i)
+            self.metrics.set('rssi_dropped_total', rssi.getDropCount(), link=i)
+            self.metrics.set('rssi_retransmitted_total', rssi.getRetranCount(), link=i)
 
     def stop(self):
         print("Stopping servers...")
+        self._write_coalescer.flush()
+        if self._replay_en:
+            self.CaptureReplay.stop_replay()
         if hasattr(self, 'epics'):
             print("Stopping EPICS server...")
             self.epics.stop()
         super(LocalServer, self).stop()
 
+class ServerLoop():
+    """
+    Asyncio-based main loop used in server mode.
+
+    It periodically runs operational tasks, like the FPGA link health check,
+    and serves a JSON snapshot of the server status on a local HTTP endpoint
+    (http://localhost:port/status). The snapshot is built only from cached
+    values, so a probe never touches the EPICS or Pyro paths nor generates
+    register transactions.
+
+    Blocking task functions are run in the loop's thread pool executor, so
+    the loop remains responsive while a task is waiting on the hardware.
+
+    The loop stops when SIGTERM or SIGINT (Ctrl+C) is received.
+    """
+    def __init__(self, root, status_port=0, health_period=5.0):
+        self._root = root
+        self._start_time = time.time()
+        self._host_name = get_host_name()
+        self._loop = None
+        self._stop_event = None
+
+        # Periodic tasks: list of (name, period, function)
+        self._tasks = []
+
+        # Status providers: name -> function returning a JSON-serializable object
+        self._status = {}
+
+        # HTTP routes: port -> {path -> (content type, function returning a string)}
+        self._routes = {}
+
+        # Default status content, tasks and routes
+        self.add_status('server', self._server_status)
+        self.add_status('link', root.get_health)
+        self.add_task('health', health_period, root.check_health)
+        if status_port:
+            self.add_route(status_port, '/status', 'application/json', self.get_status_json)
+
+    def add_task(self, name, period, function):
+        """
+        Function to add a task to be called every "period" seconds
+        """
+        self._tasks.append((name, period, function))
+
+    def add_status(self, name, function):
+        """
+        Function to add an entry to the status snapshot
+        """
+        self._status[name] = function
+
+    def add_route(self, port, path, content_type, function):
+        """
+        Function to add a path to the local HTTP endpoint on "port"
+        """
+        self._routes.setdefault(port, {})[path] = (content_type, function)
+
+    def get_status_json(self):
+        """
+        Function to get the status snapshot as a JSON string
+        """
+        status = {}
+        for name, function in self._status.items():
+            try:
+                status[name] = function()
+            except Exception as e:
+                status[name] = {'error': str(e)}
+        return json.dumps(status, default=str)
+
+    def run(self, handle_signals=True):
+        """
+        Function to run the loop. It blocks until the loop is stopped.
+        Signal handlers can only be installed from the main thread.
+        """
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        try:
+            self._loop.run_until_complete(self._main(handle_signals))
+        finally:
+            self._loop.close()
+
+    def stop(self):
+        """
+        Function to request the loop to stop. It is safe to call it
+        from any thread.
+        """
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def _server_status(self):
+        return {
+            'pid': os.getpid(),
+            'host': self._host_name,
+            'uptime': time.time() - self._start_time,
+            'threads': threading.active_count()}
+
+    async def _main(self, handle_signals):
+        self._stop_event = asyncio.Event()
+
+        if handle_signals:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                self._loop.add_signal_handler(sig, self._stop_event.set)
+
+        # Start the HTTP endpoints
+        http_servers = []
+        for port, routes in self._routes.items():
+            http_servers.append(await asyncio.start_server(
+                lambda r, w, routes=routes: self._handle_http(routes, r, w),
+                host='127.0.0.1', port=port))
+            for path in routes:
+                print("Endpoint available at http://localhost:{}{}".format(port, path))
+
+        workers = [asyncio.ensure_future(self._run_task(*task)) for task in self._tasks]
+
+        # Wait until a stop is requested
+        await self._stop_event.wait()
+        print("Stopping server loop...")
+
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for http_server in http_servers:
+            http_server.close()
+            await http_server.wait_closed()
+
+        if handle_signals:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                self._loop.remove_signal_handler(sig)
+
+    async def _run_task(self, name, period, function):
+        while not self._stop_event.is_set():
+            try:
+                await self._loop.run_in_executor(None, function)
+            except Exception as e:
+                print("Error in server loop task \"{}\": {}".format(name, e))
+
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), period)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _handle_http(self, routes, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            path = request.decode('latin-1').split(' ')[1].split('?')[0]
+
+            # Consume the request headers
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+
+            if path in routes:
+                content_type, function = routes[path]
+                body = (await self._loop.run_in_executor(None, function)).encode('utf-8')
+                status = '200 OK'
+            else:
+                content_type = 'text/plain'
+                body = b'Not Found\n'
+                status = '404 Not Found'
+
+            writer.write('HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'\
+                .format(status, content_type, len(body)).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, IndexError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
 class PcieCard():
     """
     Class to setup the PCIe RSSI card.
@@ -726,19 +3593,34 @@ if __name__ == "__main__":
     polling_en = True
     stream_pv_size = 0
     stream_pv_type = "UInt16"
-    stream_pv_valid_types = ["UInt16", "Int16", "UInt32", "Int32"]
+    stream_pv_valid_types = stream_data_types
+    stream_pv_channels = 1
+    stream_pv_header_size = 0
+    replay_file = ""
+    replay_rate = 1.0
+    tuning_file = ""
+    tuning = {}
+    recovery_checks = 3
+    gui_refresh_period = 0
     comm_type = "eth-rssi-non-interleaved";
     comm_type_valid_types = ["eth-rssi-non-interleaved", "eth-rssi-interleaved", "pcie-rssi-interleaved"]
     pcie_rssi_link=None
     pv_dump_file= ""
     pcie_dev=Path("/dev/datadev_0")
+    status_port = 0
+    metrics_port = 0
+    output_dir = "/tmp"
+    ring_depth = 0
 
     # Read Arguments
     try:
         opts, _ = getopt.getopt(sys.argv[1:],
-            "ha:sp:e:d:nb:f:c:l:u:",
+            "ha:sp:e:d:nb:f:c:l:u:w:m:o:r:i:k:x:q:y:j:g:",
             ["help", "addr=", "server", "pyro=", "epics=", "defaults=", "nopoll",
-            "stream-size=", "stream-type=", "commType=", "pcie-rssi-link=", "dump-pvs="])
+            "stream-size=", "stream-type=", "commType=", "pcie-rssi-link=", "dump-pvs=",
+            "status-port=", "metrics-port=", "output-dir=", "ring-depth=",
+            "stream-channels=", "stream-header=", "replay=", "replay-rate=",
+            "tuning-file=", "link-recovery=", "gui-refresh="])
     except getopt.GetoptError:
         usage(sys.argv[0])
         sys.exit()
@@ -781,6 +3663,54 @@ if __name__ == "__main__":
             pcie_rssi_link = int(arg)
         elif opt in ("-u", "--dump-pvs"):   # Dump PV file
             pv_dump_file = arg
+        elif opt in ("-w", "--status-port"):  # Status endpoint port
+            try:
+                status_port = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid status port")
+        elif opt in ("-m", "--metrics-port"):  # Metrics exporter port
+            try:
+                metrics_port = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid metrics port")
+        elif opt in ("-o", "--output-dir"):  # Output directory
+            output_dir = arg
+        elif opt in ("-r", "--ring-depth"):  # Stream ring buffer depth
+            try:
+                ring_depth = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid ring depth")
+        elif opt in ("-i", "--stream-channels"): # Stream interleaved channels (on PVs)
+            try:
+                stream_pv_channels = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid number of stream channels")
+            if stream_pv_channels < 1:
+                exit_message("ERROR: Invalid number of stream channels")
+        elif opt in ("-k", "--stream-header"): # Stream header size (on PVs)
+            try:
+                stream_pv_header_size = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid stream header size")
+        elif opt in ("-x", "--replay"):      # Capture file to replay
+            replay_file = arg
+        elif opt in ("-q", "--replay-rate"): # Capture file replay rate
+            try:
+                replay_rate = float(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid replay rate")
+        elif opt in ("-y", "--tuning-file"): # Tuning file
+            tuning_file = arg
+        elif opt in ("-j", "--link-recovery"): # Link recovery threshold
+            try:
+                recovery_checks = int(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid number of link health checks")
+        elif opt in ("-g", "--gui-refresh"): # GUI refresh period
+            try:
+                gui_refresh_period = float(arg)
+            except ValueError:
+                exit_message("ERROR: Invalid GUI refresh period")
 
     # Verify if IP address is valid
     if ip_addr:
@@ -789,8 +3719,19 @@ if __name__ == "__main__":
         except socket.error:
             exit_message("ERROR: Invalid IP Address.")
 
+    # Load the tuning file
+    if tuning_file:
+        try:
+            tuning = load_tuning_file(tuning_file)
+        except (IOError, yaml.YAMLError, ValueError) as e:
+            exit_message("ERROR: Could not load the tuning file: {}".format(e))
+
+    # Verify the capture file to replay exists
+    if replay_file and not os.path.isfile(replay_file):
+        exit_message("ERROR: Capture file \"{}\" does not exist".format(replay_file))
+
     # Check connection with the board if using eth communication
-    if "eth-" in comm_type:
+    if "eth-" in comm_type and not replay_file:
         if not ip_addr:
             exit_message("ERROR: Must specify an IP address for Ethernet base communication devices.")
 
@@ -807,12 +3748,16 @@ if __name__ == "__main__":
     if server_mode and not (group_name or epics_prefix):
         exit_message("    ERROR: Can not start in server mode without Pyro or EPICS server")
 
-    # Try to import the FpgaTopLevel definition
-    try:
-        from FpgaTopLevel import FpgaTopLevel
-    except ImportError as ie:
-        print("Error importing FpgaTopLevel: {}".format(ie))
-        exit()
+    if not os.path.isdir(output_dir):
+        exit_message("    ERROR: Output directory \"{}\" does not exist".format(output_dir))
+
+    # Try to import the FpgaTopLevel definition. It is not needed when replaying a capture file
+    if not replay_file:
+        try:
+            from FpgaTopLevel import FpgaTopLevel
+        except ImportError as ie:
+            print("Error importing FpgaTopLevel: {}".format(ie))
+            exit()
 
     # If EPICS server is enable, import the epics module
     if epics_prefix:
@@ -837,15 +3782,20 @@ if __name__ == "__main__":
     # Import the QT and GUI modules if not in server mode
     if not server_mode:
         import pyrogue.gui
+        import pyrogue_gui
 
-    # The PCIeCard object will take care of setting up the PCIe card (if present)
-    with PcieCard(link=pcie_rssi_link, comm_type=comm_type, ip_addr=ip_addr):
+    # The PCIeCard object will take care of setting up the PCIe card (if present).
+    # It is not used when replaying a capture file.
+    with contextlib.ExitStack() as stack:
+        pcie_card = None
+        if not replay_file:
+            pcie_card = stack.enter_context(
+                PcieCard(link=pcie_rssi_link, comm_type=comm_type, ip_addr=ip_addr))
 
         # Start pyRogue server
         server = LocalServer(
             ip_addr=ip_addr,
             config_file=config_file,
-            server_mode=server_mode,
             group_name=group_name,
             epics_prefix=epics_prefix,
             polling_en=polling_en,
@@ -853,7 +3803,41 @@ if __name__ == "__main__":
             pcie_rssi_link=pcie_rssi_link,
             stream_pv_size=stream_pv_size,
             stream_pv_type=stream_pv_type,
-            pv_dump_file=pv_dump_file)
+            pv_dump_file=pv_dump_file,
+            stream_pv_channels=stream_pv_channels,
+            stream_pv_header_size=stream_pv_header_size,
+            metrics_en=bool(metrics_port),
+            output_dir=output_dir,
+            ring_depth=ring_depth,
+            replay_file=replay_file,
+            replay_rate=replay_rate,
+            tuning=tuning,
+            pcie_card=pcie_card,
+            recovery_checks=recovery_checks)
+
+        server_loop = ServerLoop(root=server, status_port=status_port)
+        if metrics_port:
+            server_loop.add_route(metrics_port, '/metrics', 'text/plain; version=0.0.4',
+                server.metrics.render)
+
+        # If no in server Mode, start the GUI
+        if not server_mode:
+            # Run the server loop in the background while the GUI is open,
+            # if its endpoints or the link recovery were requested
+            if status_port or metrics_port or (recovery_checks and not replay_file):
+                server_loop_thread = threading.Thread(target=server_loop.run,
+                    kwargs={'handle_signals': False}, daemon=True)
+                server_loop_thread.start()
+                create_gui(server, refresh_period=gui_refresh_period)
+                server_loop.stop()
+                server_loop_thread.join()
+            else:
+                create_gui(server, refresh_period=gui_refresh_period)
+        else:
+            # Run the server loop until Crtl+C is pressed or SIGTERM is received
+            print("")
+            print("Running in server mode now. Press Ctrl+C to stop...")
+            server_loop.run()
 
     # Stop server
     server.stop()
@@ -0,0 +1,86 @@
+% acquireData acquires a block of consecutive triggered frames
+%     using the server-side acquisition engine.
+%
+%     [data, t, seq] = acquireData(num, frames) acquires 'frames'
+%     consecutive frames from channel number 'num' (0 to 7). The
+%     server sends the triggers and collects the frames, so the
+%     whole block is read back with a single lcaGet.
+%
+%     'data' is a matrix with one column per frame, 't' are the
+%     frame timestamps (in seconds) and 'seq' the frame numbers,
+%     counted by the server across all the acquisitions. They are
+%     always consecutive within one acquisition, so they can not
+%     be used to detect frames lost before reaching the server.
+%
+%     If the server rejects the request (invalid parameters, not
+%     enough memory, or another acquisition running), nothing is
+%     returned.
+%
+%     EXAMPLES:
+%         [data, t, seq] = acquireData(0, 100) acquires 100 frames from channel 0
+%         plot(data(:,1))                     plots the first frame
+
+function [data, t, seq] = acquireData(num, frames)
+    % Global variables define by setEnv
+    global acqFramesPV
+    global acqChannelMaskPV
+    global acqStartPV
+    global acqStatePV
+    global acqIdPV
+    global acqDataPV
+    global acqTimestampsPV
+    global acqSequencePV
+
+    data = [];
+    t = [];
+    seq = [];
+
+    if num > 7 | num < 0
+        disp('Channel number not valid. Must be between 0 and 7.')
+        return
+    end
+
+    % Setup and start the acquisition. A new acquisition ID means
+    % the request was accepted.
+    lastId = lcaGet(acqIdPV);
+    lcaPut(acqFramesPV, frames);
+    lcaPut(acqChannelMaskPV, 2^num);
+    lcaPut(acqStartPV, 1);
+
+    accepted = false;
+    for i = 1:10
+        if lcaGet(acqIdPV) ~= lastId
+            accepted = true;
+            break
+        end
+        pause(0.1);
+    end
+
+    state = deblank(char(lcaGet(acqStatePV)));
+    if ~accepted
+        disp(['Acquisition request rejected. State: ' state])
+        return
+    end
+
+    % Wait for the acquisition to finish
+    while strcmp(state, 'Running')
+        pause(0.1);
+        state = deblank(char(lcaGet(acqStatePV)));
+    end
+
+    if ~strcmp(state, 'Done')
+        disp(['Acquisition failed. State: ' state])
+        return
+    end
+
+    % Read the whole block. The arrays can be padded with zeros up to
+    % the maximum number of frames, so only the acquired frames (the
+    % ones with a timestamp) are kept.
+    t   = lcaGet(acqTimestampsPV(num + 1));
+    seq = lcaGet(acqSequencePV(num + 1));
+    y   = lcaGet(acqDataPV(num + 1));
+    data = reshape(y, [], length(t));
+    n    = nnz(t);
+    data = data(:, 1:n);
+    t    = t(1:n);
+    seq  = seq(1:n);
@@ -17,6 +17,7 @@ function continuosPlot(num, poll)
     global DMBufferSizePV
     global DMIndex
     global streamPV
+    global streamEnablePV
 
     if num > 3 | num < 0
         disp('Channel number not valid. Must be between 0 and 3.')
@@ -27,6 +28,12 @@ function continuosPlot(num, poll)
         else
             % Get the size of the DaqMux
             stm_size = lcaGet(DMBufferSizePV)*2;
+
+            % Make sure the stream data PV is updated, and restore its
+            % previous update state when the plot ends (even if interrupted)
+            streamEnable = lcaGet(streamEnablePV(num + 1), 0, 'double');
+            lcaPut(streamEnablePV(num + 1), 1);
+            restoreEnable = onCleanup(@() lcaPut(streamEnablePV(num + 1), streamEnable));
             
             % Create a new canvas with a break button to stop the loop
             dialogBox = uicontrol('Style', 'PushButton', 'String', 'Break','Callback', 'delete(gcbf)');
@@ -1,16 +1,41 @@
-% plotData plots the data received from the DaqMux
-%     triggerDM should be call before calling this function,
-%     so new data is available to be plotted. 
+% plotData triggers the DaqMux and plots the data received
+%     from the 4 stream channels of the DaqMux.
+%     The stream data PVs are enabled before sending the trigger,
+%     and restored to their previous state after reading the data.
 
 function plotData
     % Global variables define by setEnv
     global DMBufferSizePV
     global DMIndex
     global streamPV
+    global streamEnablePV
+    global streamFrameCountPV
 
     % Get the size of the DaqMux
     stm_size = lcaGet(DMBufferSizePV)*2;
 
+    % Streams of this DaqMux
+    stmIdx = 4 * DMIndex + (1:4);
+
+    % Make sure the stream data PVs are updated, and remember their
+    % previous update state and number of frames received
+    streamEnable = lcaGet(streamEnablePV(stmIdx)', 0, 'double');
+    lcaPut(streamEnablePV(stmIdx)', ones(4, 1));
+    frameCount = lcaGet(streamFrameCountPV(stmIdx)');
+
+    % Trigger the DaqMux, and wait for the new frames to arrive
+    triggerDM
+    for k = 1:30
+        pause(0.1);
+        if all(lcaGet(streamFrameCountPV(stmIdx)') > frameCount)
+            break
+        end
+    end
+
+    if ~all(lcaGet(streamFrameCountPV(stmIdx)') > frameCount)
+        disp('Not all the streams received new data. Plotting the last data received.')
+    end
+
     % Create a new canvas
     figure(1)
     set(gcf, 'Position', [100, 100, 1400, 1200])
@@ -31,3 +56,6 @@ function plotData
         plot(x,y)
         title(['Stream' num2str(stmNum)])
     end
+
+    % Restore the previous stream data PVs update state
+    lcaPut(streamEnablePV(stmIdx)', streamEnable);
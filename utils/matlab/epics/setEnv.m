@@ -31,7 +31,17 @@ function setEnv(prefix)
     global WEBStartAddrPV
     global WEBEndAddrPV
     global streamPV
+    global streamEnablePV
+    global streamFrameCountPV
     global cmdJesdRst
+    global acqFramesPV
+    global acqChannelMaskPV
+    global acqStartPV
+    global acqStatePV
+    global acqIdPV
+    global acqDataPV
+    global acqTimestampsPV
+    global acqSequencePV
     
     % PV name prefix
     PVNamePrefix = prefix;
@@ -63,8 +73,27 @@ function setEnv(prefix)
     end
     
     streamPV = {''};
+    streamEnablePV = {''};
+    streamFrameCountPV = {''};
     for i =0:7
     	streamPV(i+1) = {[PVNamePrefix ':AMCc:Stream' num2str(i)]};
+    	streamEnablePV(i+1) = {[PVNamePrefix ':AMCc:StreamEnable' num2str(i)]};
+    	streamFrameCountPV(i+1) = {[PVNamePrefix ':AMCc:StreamFrameCount' num2str(i)]};
+    end
+
+    acqFramesPV      = [PVNamePrefix ':AMCc:StreamAcqFrames'];
+    acqChannelMaskPV = [PVNamePrefix ':AMCc:StreamAcqChannelMask'];
+    acqStartPV       = [PVNamePrefix ':AMCc:StreamAcqStart'];
+    acqStatePV       = [PVNamePrefix ':AMCc:StreamAcqState'];
+    acqIdPV          = [PVNamePrefix ':AMCc:StreamAcqId'];
+
+    acqDataPV       = {''};
+    acqTimestampsPV = {''};
+    acqSequencePV   = {''};
+    for i =0:7
+    	acqDataPV(i+1)       = {[PVNamePrefix ':AMCc:StreamAcqData' num2str(i)]};
+    	acqTimestampsPV(i+1) = {[PVNamePrefix ':AMCc:StreamAcqTimestamps' num2str(i)]};
+    	acqSequencePV(i+1)   = {[PVNamePrefix ':AMCc:StreamAcqSequence' num2str(i)]};
     end
     
     disp('Done setting enviroment.')
@@ -1,6 +1,6 @@
 % triggerDM sends a triiger command to the DaqMux.
-%     After calling this function call plotData to plotData
-%     teh received data.
+%     plotData calls this function before plotting
+%     the received data.
 
 function triggerDM
     % Global variables define by setEnv